@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Alert-by-reference protocol shared by server.py and the PDA publishers.
+
+Instead of an MP3 per alert, the server sends a small JSON reference on
+ALERT_REF_TOPIC:
+
+    {"kind": "motion", "clip": "motion_alert.mp3", "sha256": "...", "text": "..."}
+
+A client plays the clip from its local cache when it already has that hash.
+On a miss it sends {"sha256": "..."} on CLIP_REQUEST_TOPIC back to the sender,
+which answers with the raw MP3 bytes on CLIP_TOPIC. Clips are cached on disk
+by content hash, so an edited clip on the server is simply a new hash and a
+stale one can never be played.
+"""
+import hashlib
+import json
+import os
+
+ALERT_REF_TOPIC = "alert_ref"
+CLIP_REQUEST_TOPIC = "alert_clip_request"
+CLIP_TOPIC = "alert_clip"
+
+
+def encode_alert_ref(kind, clip, sha256, text):
+    return json.dumps({"kind": kind, "clip": clip, "sha256": sha256, "text": text}).encode()
+
+
+def decode_alert_ref(payload):
+    """Parse an alert reference; returns a dict with kind, clip, sha256 and text"""
+    ref = json.loads(payload.decode())
+    if not isinstance(ref, dict) or not isinstance(ref.get("sha256"), str):
+        raise ValueError("alert reference without a clip hash")
+    return ref
+
+
+def encode_clip_request(sha256):
+    return json.dumps({"sha256": sha256}).encode()
+
+
+def decode_clip_request(payload):
+    """The requested clip hash; ValueError for anything but {"sha256": "<str>"}"""
+    request = json.loads(payload.decode())
+    if not isinstance(request, dict) or not isinstance(request.get("sha256"), str):
+        raise ValueError("clip request without a clip hash")
+    return request["sha256"]
+
+
+class AlertClipCache:
+    """Client-side alert clips on disk, keyed by SHA-256 of their bytes"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("ALERT_CACHE_DIR", os.path.expanduser("~/.copilot/alert_clips"))
+        os.makedirs(self.directory, exist_ok=True)
+        self.waiting = {}  # sha256 -> alert references waiting for the clip to arrive
+
+    def path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.mp3")
+
+    def lookup(self, sha256):
+        """Path of the cached clip, or None on a miss"""
+        path = self.path(sha256)
+        return path if os.path.exists(path) else None
+
+    def wait_for(self, ref):
+        """Remember an alert until its clip arrives; returns True if the clip should be requested"""
+        pending = self.waiting.setdefault(ref["sha256"], [])
+        pending.append(ref)
+        return len(pending) == 1
+
+    def store(self, data):
+        """Cache clip bytes; returns (path, alert references that were waiting for it)"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        # Write then rename so a crash never leaves a truncated clip under a valid hash
+        partial = f"{path}.part"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+        return path, self.waiting.pop(sha256, [])
+
+    def give_up(self, sha256):
+        """Stop waiting for a clip; returns the alert references still pending"""
+        return self.waiting.pop(sha256, [])
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Alert delivery for server.py.
+
+AlertAssetRegistry loads every alert clip once at startup, validates it and
+keeps the bytes in memory, so sending an alert never touches the disk. A
+background watcher reloads clips whose files change.
+
+AlertDispatcher decouples detection from delivery: detection loops call
+submit(), which never blocks, and a single dispatcher task does the network
+I/O. Identical alerts (same participant, type and clip) are coalesced while
+one is still queued or was sent within the coalescing window, and token
+buckets cap alerts per participant and per alert type.
+
+Alerts are addressed, not broadcast: each one goes to the participant whose
+stream triggered it plus the ALERT_SUPERVISORS fan-out list, so a clip is
+delivered to a fixed handful of recipients however many officers are in the
+room. An alert with no identity (e.g. the startup test alert) still goes to
+everyone.
+
+By default each alert carries the clip's bytes ("audio_alert", or the text
+on "alert" if the clip is missing), which every client understands. With
+ALERT_BY_REFERENCE=1 the dispatcher sends a small reference to the clip
+instead and serves the clip itself only to clients that ask for it (see
+alert_cache.py). Only cloud_pda_publisher.py and pi_pda_publisher.py speak
+that protocol, so turn it on only once every alert recipient runs one of
+them; pda_publisher.py and test_pda_publisher.py would hear nothing.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+
+from alert_cache import ALERT_REF_TOPIC, CLIP_TOPIC, decode_clip_request, encode_alert_ref
+from metrics import ALERT_QUEUE_DEPTH, ALERTS_SENT, PAYLOAD_BYTES
+
+ALERT_CLIPS = ("motion_alert.mp3", "speech_alert.mp3")
+
+
+@dataclass
+class AlertAsset:
+    name: str
+    path: str
+    data: bytes
+    sha256: str
+    mtime: float
+
+
+def is_mp3(data):
+    """Cheap sanity check: an ID3 tag or an MPEG audio frame sync at the start"""
+    if data[:3] == b"ID3":
+        return True
+    return len(data) > 1 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0
+
+
+class AlertAssetRegistry:
+    """In-memory alert clips keyed by file name"""
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.assets = {}
+
+    def _read(self, name):
+        """Read and validate one clip from disk; returns an AlertAsset or None"""
+        path = os.path.join(self.directory, name)
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"❌ Alert clip unavailable: {path} ({e})")
+            return None
+        if not is_mp3(data):
+            print(f"❌ Alert clip is not a valid MP3: {path}")
+            return None
+        return AlertAsset(name, path, data, hashlib.sha256(data).hexdigest(), mtime)
+
+    def load(self, names=ALERT_CLIPS):
+        for name in names:
+            asset = self._read(name)
+            if asset is not None:
+                self.assets[name] = asset
+                print(f"🎵 Loaded alert clip: {name} ({len(asset.data)} bytes)")
+        return self
+
+    def get(self, name):
+        """The in-memory clip, or None if it failed to load"""
+        return self.assets.get(name)
+
+    def by_hash(self, sha256):
+        """The in-memory clip with this content hash, or None"""
+        return next((asset for asset in self.assets.values() if asset.sha256 == sha256), None)
+
+    def reload_changed(self, names=ALERT_CLIPS):
+        """Re-read clips whose files changed; a clip that fails validation keeps its previous bytes"""
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            current = self.assets.get(name)
+            if current is not None and current.mtime == mtime:
+                continue
+            asset = self._read(name)
+            if asset is not None:
+                self.assets[name] = asset
+                print(f"🔄 Reloaded alert clip: {name} ({len(asset.data)} bytes)")
+
+    async def watch(self, interval=5.0, names=ALERT_CLIPS):
+        """Poll for changed clips forever, doing the file I/O off the event loop"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_changed, names)
+            except Exception as e:
+                print(f"❌ Alert clip reload failed: {e}")
+
+
+def parse_identities(value):
+    """Comma separated participant identities, e.g. from ALERT_SUPERVISORS"""
+    return [identity.strip() for identity in (value or "").split(",") if identity.strip()]
+
+
+async def publish(room, payload, topic, destinations=None):
+    """Reliable publish_data to `destinations` (None: whole room), counting payload bytes"""
+    await room.local_participant.publish_data(
+        payload=payload, topic=topic, reliable=True, destination_identities=list(destinations or [])
+    )
+    PAYLOAD_BYTES.inc(len(payload), room=getattr(room, "name", ""), topic=topic)
+
+
+async def send_mp3_alert(room, assets, mp3_filename, alert_text, destinations=None):
+    """Send an in-memory MP3 alert clip as a data packet; to `destinations` only, or the whole room if None"""
+    destinations = list(destinations or [])
+    try:
+        asset = assets.get(mp3_filename)
+        if asset is not None:
+            # Send MP3 data with topic "audio_alert"
+            await publish(room, asset.data, "audio_alert", destinations)
+            print(f"✅ MP3 alert sent: {mp3_filename} ({len(asset.data)} bytes) to {', '.join(destinations) or 'room'}")
+        else:
+            print(f"❌ MP3 clip not loaded: {mp3_filename}, falling back to text")
+            # Fallback to text alert
+            await publish(room, alert_text.encode(), "alert", destinations)
+    except Exception as e:
+        print(f"❌ Error sending MP3 alert: {e}")
+        # Fallback to text alert
+        await publish(room, alert_text.encode(), "alert", destinations)
+
+
+@dataclass
+class Alert:
+    kind: str  # "motion", "speech", ...
+    identity: str  # Participant whose stream triggered the alert (None: whole room)
+    clip: str  # Alert clip file name
+    text: str
+    extra: list = field(default_factory=list)  # (topic, payload) packets sent after the clip
+    count: int = 1  # Identical alerts coalesced into this one
+
+    @property
+    def key(self):
+        return (self.identity, self.kind, self.clip)
+
+
+class RateLimiter:
+    """Token bucket per key: `rate` alerts per `period` seconds, bursting up to `rate`"""
+
+    def __init__(self, rate, period):
+        self.rate = rate
+        self.period = period
+        self.buckets = {}  # key -> (tokens, last refill time)
+
+    def _tokens(self, key, now):
+        tokens, last = self.buckets.get(key, (self.rate, now))
+        return min(self.rate, tokens + (now - last) * self.rate / self.period)
+
+    def ready(self, key, now):
+        return self.rate <= 0 or self._tokens(key, now) >= 1
+
+    def take(self, key, now):
+        if self.rate > 0:
+            self.buckets[key] = (self._tokens(key, now) - 1, now)
+
+
+class AlertDispatcher:
+    """Queue-fed alert sender; submit() is safe to call from any detection loop"""
+
+    def __init__(self, room, assets, coalesce_window=2.0, participant_rate=6, type_rate=20,
+                 rate_period=60.0, max_queue=64, supervisors=(), by_reference=False):
+        self.room = room
+        self.assets = assets
+        self.supervisors = list(supervisors)
+        self.by_reference = by_reference
+        self.serving = set()  # (identity, sha256) clip requests being answered
+        self.coalesce_window = coalesce_window
+        self.participant_limit = RateLimiter(participant_rate, rate_period)
+        self.type_limit = RateLimiter(type_rate, rate_period)
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.pending = {}  # Alert.key -> queued Alert, merged into while it waits
+        self.last_sent = {}  # Alert.key -> monotonic time of the last send
+        self.stats = {"submitted": 0, "sent": 0, "coalesced": 0, "rate_limited": 0, "dropped": 0, "max_depth": 0}
+
+    @classmethod
+    def from_env(cls, room, assets):
+        return cls(
+            room, assets,
+            coalesce_window=float(os.getenv("ALERT_COALESCE_WINDOW_S", "2")),
+            participant_rate=int(os.getenv("ALERT_RATE_PER_PARTICIPANT", "6")),
+            type_rate=int(os.getenv("ALERT_RATE_PER_TYPE", "20")),
+            rate_period=float(os.getenv("ALERT_RATE_PERIOD_S", "60")),
+            max_queue=int(os.getenv("ALERT_QUEUE_SIZE", "64")),
+            supervisors=parse_identities(os.getenv("ALERT_SUPERVISORS")),
+            by_reference=os.getenv("ALERT_BY_REFERENCE", "0") == "1",
+        )
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, alert):
+        """Queue an alert without blocking; returns False if it was coalesced, rate limited or dropped"""
+        now = time.monotonic()
+        self.stats["submitted"] += 1
+        queued = self.pending.get(alert.key)
+        if queued is not None:
+            # Still waiting to go out: fold this one into it, keeping the newest text and packets
+            queued.count += alert.count
+            queued.text, queued.extra = alert.text, alert.extra
+            self.stats["coalesced"] += 1
+            return False
+        if now - self.last_sent.get(alert.key, float("-inf")) < self.coalesce_window:
+            self.stats["coalesced"] += 1
+            return False
+        if not (self.participant_limit.ready(alert.identity, now) and self.type_limit.ready(alert.kind, now)):
+            self.stats["rate_limited"] += 1
+            return False
+        try:
+            self.queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            print(f"❌ Alert queue full ({self.queue.maxsize}), dropping {alert.kind} alert for {alert.identity}")
+            return False
+        self.participant_limit.take(alert.identity, now)
+        self.type_limit.take(alert.kind, now)
+        self.pending[alert.key] = alert
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+        ALERT_QUEUE_DEPTH.set(self.depth, room=getattr(self.room, "name", ""))
+        return True
+
+    def destinations(self, alert):
+        """The triggering participant plus supervisors, or None to broadcast"""
+        if alert.identity is None:
+            return None
+        return [alert.identity] + [s for s in self.supervisors if s != alert.identity]
+
+    async def _send(self, alert):
+        destinations = self.destinations(alert)
+        asset = self.assets.get(alert.clip)
+        if self.by_reference and asset is not None:
+            await publish(self.room, encode_alert_ref(alert.kind, asset.name, asset.sha256, alert.text),
+                          ALERT_REF_TOPIC, destinations)
+        else:
+            await send_mp3_alert(self.room, self.assets, alert.clip, alert.text, destinations)
+        for topic, payload in alert.extra:
+            await publish(self.room, payload, topic, destinations)
+
+    async def run(self):
+        """Send queued alerts one at a time, forever"""
+        while True:
+            alert = await self.queue.get()
+            self.pending.pop(alert.key, None)
+            self.last_sent[alert.key] = time.monotonic()
+            try:
+                await self._send(alert)
+                self.stats["sent"] += 1
+                room = getattr(self.room, "name", "")
+                for destination in self.destinations(alert) or ["room"]:
+                    ALERTS_SENT.inc(room=room, kind=alert.kind, destination=destination)
+                if alert.count > 1:
+                    print(f"📤 {alert.kind} alert for {alert.identity} covered {alert.count} detections")
+            except Exception as e:
+                print(f"❌ Alert dispatch failed: {e}")
+            finally:
+                self.queue.task_done()
+                ALERT_QUEUE_DEPTH.set(self.depth, room=getattr(self.room, "name", ""))
+
+    def handle_clip_request(self, identity, payload):
+        """A client missed a referenced clip; send it the bytes from a separate task"""
+        try:
+            sha256 = decode_clip_request(payload)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"❌ Bad clip request from {identity}: {e}")
+            return
+        if (identity, sha256) not in self.serving:
+            self.serving.add((identity, sha256))
+            asyncio.create_task(self._serve_clip(identity, sha256))
+
+    async def _serve_clip(self, identity, sha256):
+        try:
+            asset = self.assets.by_hash(sha256)
+            if asset is None:
+                print(f"❌ {identity} requested unknown clip {sha256[:12]}")
+                return
+            await publish(self.room, asset.data, CLIP_TOPIC, [identity])
+            print(f"📦 Sent clip {asset.name} ({len(asset.data)} bytes) to {identity}")
+        except Exception as e:
+            print(f"❌ Error sending clip to {identity}: {e}")
+        finally:
+            self.serving.discard((identity, sha256))
+
+    def summary(self):
+        s = self.stats
+        return (f"depth={self.depth} max_depth={s['max_depth']} submitted={s['submitted']} sent={s['sent']} "
+                f"coalesced={s['coalesced']} rate_limited={s['rate_limited']} dropped={s['dropped']}")
+
+    async def report(self, interval=30.0):
+        """Print queue depth and counters every `interval` seconds while alerts are flowing"""
+        last = None
+        while True:
+            await asyncio.sleep(interval)
+            line = self.summary()
+            if line != last:
+                print(f"📬 Alert queue: {line}")
+                last = line
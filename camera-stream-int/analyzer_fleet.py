@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Multi-process analyzer fleet for server.py.
+
+In fleet mode the LiveKit-facing process only receives media. Each track gets
+a FrameRing in multiprocessing.shared_memory; the receiver copies the luma
+plane (or a chunk of audio samples) into the next ring slot and sends a tiny
+("frame", track_id, slot, seq) message to the worker that owns the track.
+Workers run the motion / speech detectors straight off the shared buffer and
+post small results back, with the time each analysis took, so no frame is
+ever pickled.
+
+Slots are guarded seqlock-style: the writer zeroes a slot's seq before
+copying and publishes the new seq afterwards, and a worker drops a frame if
+the seq changed under it (the receiver lapped the ring).
+"""
+import asyncio
+import queue
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from motion import MotionAnalyzer, luma_view
+from voice_activity import VoiceActivityDetector, frame_samples
+
+RING_SLOTS = 3
+AUDIO_CHUNK_MS = 100  # Audio is batched into chunks this long before it is handed to a worker
+
+SLOT_HEADER = np.dtype([("seq", "<u8"), ("rows", "<u4"), ("cols", "<u4")])
+
+
+class FrameRing:
+    """Fixed-size ring of frame slots in a shared memory block"""
+
+    def __init__(self, slots, slot_bytes, name=None):
+        size = slots * (SLOT_HEADER.itemsize + slot_bytes)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.headers = np.ndarray((slots,), dtype=SLOT_HEADER, buffer=self.shm.buf)
+        self.data = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self.shm.buf,
+                               offset=slots * SLOT_HEADER.itemsize)
+        self.seq = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, array):
+        """Copy a 1-D or 2-D array into the next slot; returns (slot, seq)"""
+        raw = array.reshape(-1).view(np.uint8)
+        rows, cols = array.shape if array.ndim == 2 else (1, array.shape[0])
+        self.seq += 1
+        slot = self.seq % self.slots
+        self.headers["seq"][slot] = 0
+        self.data[slot, :raw.size] = raw
+        self.headers["rows"][slot] = rows
+        self.headers["cols"][slot] = cols
+        self.headers["seq"][slot] = self.seq
+        return slot, self.seq
+
+    def view(self, slot, seq, dtype=np.uint8):
+        """Return a (rows, cols) view of a slot, or None if it no longer holds `seq`"""
+        if not self.holds(slot, seq):
+            return None
+        rows, cols = int(self.headers["rows"][slot]), int(self.headers["cols"][slot])
+        count = rows * cols * np.dtype(dtype).itemsize
+        return self.data[slot, :count].view(dtype).reshape((rows, cols))
+
+    def holds(self, slot, seq):
+        return self.headers["seq"][slot] == seq
+
+    def close(self):
+        # Drop our NumPy views first, SharedMemory refuses to close while they are exported
+        self.headers = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _analyze_slot(kind, ring, analyzer, slot, seq):
+    """Run the detector for one ring slot; returns a (kind, value) result or None.
+
+    Kept separate from the worker loop so no view into the ring outlives the
+    call (SharedMemory cannot be closed while views are exported).
+    """
+    if kind == "video":
+        gray = ring.view(slot, seq)
+        result = analyzer.analyze_luma(gray) if gray is not None else None
+        if not ring.holds(slot, seq):
+            return ("dropped", 1)
+        return ("motion", result) if result is not None else None
+    samples = ring.view(slot, seq, dtype=np.int16)
+    if samples is None:
+        return ("dropped", 1)
+    result = analyzer.process(samples.reshape(-1))
+    return ("vad", result) if ring.holds(slot, seq) else ("dropped", 1)
+
+
+def _run_worker(tasks, results, motion_config):
+    """Worker process: attach to rings as tracks open and analyze the frames it is told about"""
+    tracks = {}  # track_id -> (kind, ring, analyzer)
+    while True:
+        batch = [tasks.get()]
+        while True:
+            try:
+                batch.append(tasks.get_nowait())
+            except queue.Empty:
+                break
+
+        # Latest-frame-wins: only the newest queued video frame of each track is analyzed
+        latest_frame = {}
+        for i, msg in enumerate(batch):
+            if msg is not None and msg[0] == "frame":
+                latest_frame[msg[1]] = i
+
+        for i, msg in enumerate(batch):
+            if msg is None:
+                for _, ring, _ in tracks.values():
+                    ring.close()
+                return
+            op, track_id = msg[0], msg[1]
+            if op == "open":
+                kind, ring_name, slots, slot_bytes, params = msg[2:]
+                if track_id in tracks:
+                    tracks.pop(track_id)[1].close()
+                if kind == "video":
+                    analyzer = MotionAnalyzer(motion_config, params.get("roi"))
+                else:
+                    analyzer = VoiceActivityDetector(params["sample_rate"])
+                tracks[track_id] = (kind, FrameRing(slots, slot_bytes, name=ring_name), analyzer)
+            elif op == "close":
+                if track_id in tracks:
+                    tracks.pop(track_id)[1].close()
+            elif op == "frame" and track_id in tracks:
+                kind, ring, analyzer = tracks[track_id]
+                if kind == "video" and latest_frame[track_id] != i:
+                    results.put((track_id, "dropped", 1, None))
+                    continue
+                try:
+                    started = time.perf_counter()
+                    result = _analyze_slot(kind, ring, analyzer, msg[2], msg[3])
+                    if result is not None:
+                        results.put((track_id, *result, time.perf_counter() - started))
+                except Exception as e:
+                    print(f"Analyzer worker error on {track_id}: {e}")
+
+
+class _TrackFeed:
+    """Receiver-side state for one track: its ring, owning worker and audio staging buffer"""
+
+    def __init__(self, kind, worker, params):
+        self.kind = kind
+        self.worker = worker
+        self.params = params  # Sent to the worker with the ring: roi (video) or sample_rate (audio)
+        self.ring = None
+        self.staging = None
+        self.staged = 0
+
+
+class AnalyzerFleet:
+    """N analyzer processes fed through per-track shared memory rings.
+
+    Tracks are pinned to a worker (least loaded at open time) so each track's
+    background model lives in exactly one process. Results come back as
+    (track_id, kind, value, seconds) tuples from `results()`, where kind is
+    "motion" (a MotionResult), "vad" (a VadResult) or "dropped", and seconds
+    is how long the worker spent analyzing (None for frames it skipped).
+    """
+
+    def __init__(self, num_workers, motion_config):
+        self.num_workers = num_workers
+        self.motion_config = motion_config
+        self.context = mp.get_context("spawn")
+        self.results_queue = self.context.Queue()
+        self.task_queues = []
+        self.processes = []
+        self.feeds = {}
+        self._results = None
+
+    def start(self):
+        for i in range(self.num_workers):
+            tasks = self.context.Queue()
+            process = self.context.Process(
+                target=_run_worker, args=(tasks, self.results_queue, self.motion_config),
+                name=f"analyzer-{i}", daemon=True,
+            )
+            process.start()
+            self.task_queues.append(tasks)
+            self.processes.append(process)
+
+        # Hand results to the event loop from a reader thread so the loop never blocks on the queue
+        loop = asyncio.get_running_loop()
+        self._results = asyncio.Queue()
+
+        def read_results():
+            while True:
+                item = self.results_queue.get()
+                loop.call_soon_threadsafe(self._results.put_nowait, item)
+                if item is None:
+                    return
+
+        threading.Thread(target=read_results, name="analyzer-results", daemon=True).start()
+        print(f"🏭 Analyzer fleet started with {self.num_workers} worker processes")
+
+    def open_track(self, track_id, kind, roi=None):
+        load = [0] * self.num_workers
+        for feed in self.feeds.values():
+            load[feed.worker] += 1
+        self.feeds[track_id] = _TrackFeed(kind, load.index(min(load)), {"roi": roi})
+
+    def close_track(self, track_id):
+        feed = self.feeds.pop(track_id, None)
+        if feed is None:
+            return
+        self.task_queues[feed.worker].put(("close", track_id))
+        if feed.ring is not None:
+            # The worker may still be attached; unlinking only removes the name
+            feed.ring.close()
+            feed.ring.unlink()
+
+    def _publish(self, track_id, feed, array):
+        if feed.ring is None or array.nbytes > feed.ring.slot_bytes:
+            if feed.ring is not None:
+                feed.ring.close()
+                feed.ring.unlink()
+            feed.ring = FrameRing(RING_SLOTS, array.nbytes)
+            self.task_queues[feed.worker].put(
+                ("open", track_id, feed.kind, feed.ring.name, RING_SLOTS, array.nbytes, feed.params))
+        slot, seq = feed.ring.write(array)
+        self.task_queues[feed.worker].put(("frame", track_id, slot, seq))
+
+    def submit_video(self, track_id, frame):
+        """Copy the frame's luma plane into the track's ring and notify its worker"""
+        feed = self.feeds.get(track_id)
+        if feed is not None:
+            self._publish(track_id, feed, luma_view(frame))
+
+    def submit_audio(self, track_id, frame):
+        """Stage mono int16 samples and hand them to the worker every AUDIO_CHUNK_MS"""
+        feed = self.feeds.get(track_id)
+        if feed is None:
+            return
+        samples = frame_samples(frame)
+        chunk = frame.sample_rate * AUDIO_CHUNK_MS // 1000
+        if feed.staging is None or feed.staging.size != chunk:
+            feed.staging = np.empty(chunk, dtype=np.int16)
+            feed.staged = 0
+            if feed.params.get("sample_rate") != frame.sample_rate:
+                # Reopen the ring so the worker builds its VAD for the new rate
+                feed.params["sample_rate"] = frame.sample_rate
+                if feed.ring is not None:
+                    feed.ring.close()
+                    feed.ring.unlink()
+                    feed.ring = None
+        while samples.size:
+            n = min(samples.size, chunk - feed.staged)
+            feed.staging[feed.staged:feed.staged + n] = samples[:n]
+            feed.staged += n
+            samples = samples[n:]
+            if feed.staged == chunk:
+                self._publish(track_id, feed, feed.staging)
+                feed.staged = 0
+
+    async def results(self):
+        while True:
+            item = await self._results.get()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        for track_id in list(self.feeds):
+            self.close_track(track_id)
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.results_queue.put(None)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Streaming audio decode for the files server.py publishes.
+
+decode_pcm_blocks() runs ffmpeg as a subprocess that writes raw mono int16
+PCM to a pipe and yields it in fixed-size blocks as it arrives, so an
+hour-long MP3 or MP4 costs one block of memory and the first audio is
+available as soon as ffmpeg has decoded its first packet. ffmpeg also
+resamples to the rate the published track uses.
+
+ffmpeg is taken from PATH, or from the imageio-ffmpeg package that moviepy
+already installs.
+
+PcmCache keeps the decoded samples of files that are played again and
+again. The first play streams from ffmpeg and tees the samples to disk; later
+plays (including after a restart) skip the decode and read a memory-mapped
+.npy, so several server processes on one machine share the same page-cached
+samples. Entries are keyed by the source file's path, size and modification
+time plus the decode settings, so looking one up costs a stat() rather than
+a read of the whole file, and an edited file or a different output rate is a
+new entry. The cache holds at most PCM_CACHE_MAX_MB of samples (default
+1024): a decode that would not fit is played without being teed to disk, and
+the least recently played entries are evicted to make room for a new one.
+"""
+import asyncio
+import contextlib
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+PLAYBACK_SAMPLE_RATE = 48000
+BLOCK_MS = 100
+
+
+def ffmpeg_executable():
+    path = shutil.which("ffmpeg")
+    if path is None:
+        import imageio_ffmpeg
+        path = imageio_ffmpeg.get_ffmpeg_exe()
+    return path
+
+
+async def decode_pcm_blocks(path, sample_rate=PLAYBACK_SAMPLE_RATE, channels=1, block_ms=BLOCK_MS):
+    """Yield int16 PCM blocks of `block_ms` (the last may be shorter) decoded from any ffmpeg-readable file"""
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_executable(), "-nostdin", "-v", "error", "-i", path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(channels), "-ar", str(sample_rate), "-",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    block_bytes = sample_rate * block_ms // 1000 * channels * 2
+    try:
+        while True:
+            try:
+                data = await process.stdout.readexactly(block_bytes)
+            except asyncio.IncompleteReadError as e:
+                data = e.partial[:len(e.partial) // 2 * 2]
+                if data:
+                    yield np.frombuffer(data, dtype=np.int16)
+                break
+            yield np.frombuffer(data, dtype=np.int16)
+        returncode = await process.wait()
+        if returncode != 0:
+            error = (await process.stderr.read()).decode(errors="replace").strip()
+            raise RuntimeError(f"ffmpeg could not decode {path}: {error}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+async def prefetch(blocks):
+    """Decode the first block now; returns an iterator that yields it followed by the rest"""
+    first = await anext(blocks, None)
+
+    async def chained():
+        if first is not None:
+            yield first
+        async for block in blocks:
+            yield block
+    return chained()
+
+
+def file_key(path):
+    """Cache key of a source file: a hash of its absolute path, size and modification time"""
+    st = os.stat(path)
+    return hashlib.sha256(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+
+
+class PcmCache:
+    """On-disk cache of decoded mono/stereo int16 PCM, read back with np.load(mmap_mode='r')"""
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.getenv("PCM_CACHE_DIR", os.path.expanduser("~/.cache/copilot/pcm"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("PCM_CACHE_MAX_MB", "1024")) * 2**20)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key, sample_rate, channels):
+        return os.path.join(self.directory, f"{key}-{sample_rate}hz-{channels}ch.npy")
+
+    def _save(self, raw_path, path):
+        """Turn a raw s16le tee file into an .npy entry, publishing it atomically"""
+        samples = np.memmap(raw_path, dtype=np.int16, mode='r')
+        partial = f"{path}.{os.getpid()}.part"
+        with open(partial, 'wb') as f:
+            np.save(f, samples)
+        del samples
+        os.replace(partial, path)
+        self._evict(path)
+
+    def _evict(self, keep):
+        """Delete the least recently played entries until the cache fits in max_bytes"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy") and entry.path != keep:
+                with contextlib.suppress(OSError):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.unlink(path)  # Processes still playing it keep their mapping
+                total -= size
+                print(f"🗑️ Evicted decoded audio cache entry {os.path.basename(path)}")
+
+    async def decode_pcm_blocks(self, path, sample_rate=PLAYBACK_SAMPLE_RATE, channels=1, block_ms=BLOCK_MS):
+        """Like decode_pcm_blocks(), served from the cache when this file was decoded before"""
+        cached = self.path(file_key(path), sample_rate, channels)
+        block = sample_rate * block_ms // 1000 * channels
+        if os.path.exists(cached):
+            samples = np.load(cached, mmap_mode='r')
+            with contextlib.suppress(OSError):
+                os.utime(cached)  # Most recently played entries are evicted last
+            print(f"💾 Decoded audio cache hit: {path} ({samples.size / channels / sample_rate:.1f}s)")
+            for offset in range(0, samples.size, block):
+                yield samples[offset:offset + block]
+            return
+
+        raw_path = f"{cached}.{os.getpid()}.raw"
+        written = 0
+        complete = False
+        try:
+            # aclosing() stops ffmpeg right away if playback is abandoned
+            async with contextlib.aclosing(decode_pcm_blocks(path, sample_rate, channels, block_ms)) as decoded:
+                with open(raw_path, 'wb') as raw:
+                    async for samples in decoded:
+                        if written is not None:
+                            written += samples.nbytes
+                            if written > self.max_bytes:
+                                # Too big to cache: stop teeing and drop what was written so far
+                                raw.truncate(0)
+                                written = None
+                            else:
+                                raw.write(samples.tobytes())
+                        yield samples
+            if written:
+                await asyncio.to_thread(self._save, raw_path, cached)
+                complete = True
+                print(f"💾 Cached decoded audio: {path}")
+        finally:
+            # A decode that failed, was abandoned part way or produced nothing never becomes a cache entry
+            if os.path.exists(raw_path):
+                os.unlink(raw_path)
+            if not complete:
+                reason = "larger than PCM_CACHE_MAX_MB" if written is None else "playback did not finish or decoded nothing"
+                print(f"⚠️ Decoded audio for {path} not cached ({reason})")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Background models for the motion detector in server.py.
+
+Each model keeps its state in buffers allocated once per track (and again only
+if the frame size changes). `apply(gray)` takes a blurred uint8 luma frame and
+returns a binary 0/255 foreground mask, or None while the model is still
+warming up. The returned mask is the model's own buffer and is overwritten by
+the next call.
+"""
+import os
+import numpy as np
+import cv2
+
+DIFF_THRESHOLD = 25  # Per-pixel luma change that counts as motion
+
+
+class BackgroundModel:
+    """Base class: owns the per-track mask buffer and handles size changes"""
+
+    def __init__(self):
+        self.shape = None
+        self.mask = None
+
+    def _ensure_shape(self, gray):
+        """Reallocate buffers for a new frame size; returns True if the model was reset"""
+        if self.shape == gray.shape:
+            return False
+        self.shape = gray.shape
+        self.mask = np.empty(gray.shape, dtype=np.uint8)
+        self.reset(gray)
+        return True
+
+    def reset(self, gray):
+        """Seed the model from `gray` (called on the first frame and on size changes)"""
+
+    def apply(self, gray):
+        raise NotImplementedError
+
+
+class RunningAverageModel(BackgroundModel):
+    """Exponential running average of the scene via cv2.accumulateWeighted"""
+
+    def __init__(self, alpha=None):
+        super().__init__()
+        self.alpha = alpha if alpha is not None else float(os.getenv("MOTION_BACKGROUND_ALPHA", "0.05"))
+        self.average = None
+        self.background = None
+
+    def reset(self, gray):
+        self.average = gray.astype(np.float32)
+        self.background = np.empty(gray.shape, dtype=np.uint8)
+
+    def apply(self, gray):
+        if self._ensure_shape(gray):
+            return None
+        cv2.convertScaleAbs(self.average, dst=self.background)
+        cv2.absdiff(self.background, gray, dst=self.mask)
+        cv2.threshold(self.mask, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=self.mask)
+        cv2.accumulateWeighted(gray, self.average, self.alpha)
+        return self.mask
+
+
+class FrameDifferenceModel(BackgroundModel):
+    """Difference against the previous analyzed frame"""
+
+    def __init__(self):
+        super().__init__()
+        self.previous = None
+
+    def reset(self, gray):
+        self.previous = gray.copy()
+
+    def apply(self, gray):
+        if self._ensure_shape(gray):
+            return None
+        cv2.absdiff(self.previous, gray, dst=self.mask)
+        cv2.threshold(self.mask, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=self.mask)
+        np.copyto(self.previous, gray)
+        return self.mask
+
+
+class SubtractorModel(BackgroundModel):
+    """Wraps an OpenCV BackgroundSubtractor (MOG2 / KNN)"""
+
+    def __init__(self, factory, learning_rate=-1):
+        super().__init__()
+        self.factory = factory
+        self.learning_rate = learning_rate
+        self.subtractor = None
+        self.warmup = 1  # Frames (seed included) whose mask is not meaningful yet
+        self.seen = 0
+
+    def reset(self, gray):
+        self.subtractor = self.factory()
+        # KNN reports the whole frame as foreground until it holds 2 * kNNSamples samples per pixel
+        # (the first 4 frames by default); MOG2 is usable right after the seed
+        knn_samples = getattr(self.subtractor, "getkNNSamples", None)
+        self.warmup = 2 * knn_samples() if knn_samples is not None else 1
+        self.subtractor.apply(gray, self.mask, self.learning_rate)
+        self.seen = 1
+
+    def apply(self, gray):
+        if self._ensure_shape(gray):
+            return None
+        self.subtractor.apply(gray, self.mask, self.learning_rate)
+        self.seen += 1
+        if self.seen <= self.warmup:
+            return None
+        return self.mask
+
+
+BACKGROUND_MODELS = {
+    "running_average": RunningAverageModel,
+    "frame_diff": FrameDifferenceModel,
+    "mog2": lambda: SubtractorModel(lambda: cv2.createBackgroundSubtractorMOG2(detectShadows=False)),
+    "knn": lambda: SubtractorModel(lambda: cv2.createBackgroundSubtractorKNN(detectShadows=False)),
+}
+
+
+def create_background_model(name=None):
+    """Create a background model by name (defaults to MOTION_BACKGROUND_MODEL, then running_average)"""
+    name = name or os.getenv("MOTION_BACKGROUND_MODEL", "running_average")
+    if name not in BACKGROUND_MODELS:
+        raise ValueError(f"Unknown background model '{name}', expected one of: {', '.join(BACKGROUND_MODELS)}")
+    return BACKGROUND_MODELS[name]()
@@ -1,31 +1,25 @@
 import asyncio
 from livekit import rtc
-from livekit.api import AccessToken, VideoGrants
 import cv2
 import pyaudio
 import subprocess
 import threading
 import os
 from dotenv import load_dotenv
+from tokens import get_token
+from alert_cache import (ALERT_REF_TOPIC, CLIP_REQUEST_TOPIC, CLIP_TOPIC, AlertClipCache,
+                         decode_alert_ref, encode_clip_request)
 
 # Load environment variables from .env file
 load_dotenv('.env')
 
-def generate_token(identity="copilot-officer", name="Copilot Officer", roomName="copilot-room"):
-    api_key = os.getenv('LIVEKIT_API_KEY')
-    api_secret = os.getenv('LIVEKIT_API_SECRET')
-    
-    token = AccessToken(api_key, api_secret) \
-        .with_identity(identity) \
-        .with_name(name) \
-        .with_grants(VideoGrants(
-            room_join=True,
-            room=roomName,
-        ))
-    return token.to_jwt()
-
 async def publish_stream():
     room = rtc.Room()
+    loop = asyncio.get_running_loop()
+    
+    # Alert clips cached by hash; with ALERT_BY_REFERENCE=1 the server only sends a clip when we miss
+    clip_cache = AlertClipCache()
+    clip_timeout = float(os.getenv("ALERT_CLIP_TIMEOUT_S", "3"))
     
     # Set up event handlers BEFORE connecting
     @room.on("connected")
@@ -81,10 +75,52 @@ async def publish_stream():
             traceback.print_exc()
             play_alert_audio("Audio alert received")
 
+    def play_cached_clip(path, text):
+        """Play a cached MP3 alert clip straight from disk, speaking the text if that fails"""
+        result = subprocess.run(["mpg123", "-q", path], capture_output=True, text=True)
+        if result.returncode == 0:
+            print("✅ Cached alert clip played through headphone jack")
+        else:
+            print(f"❌ Error playing cached clip: {result.stderr}")
+            play_alert_audio(text)
+    
+    def start_audio_thread(target, *args):
+        audio_thread = threading.Thread(target=target, args=args)
+        audio_thread.daemon = False
+        audio_thread.start()
+    
+    def on_clip_timeout(sha256):
+        # The clip never arrived; at least speak what the alerts said
+        for ref in clip_cache.give_up(sha256):
+            print(f"⌛ Clip {sha256[:12]} not received, speaking alert text")
+            start_audio_thread(play_alert_audio, ref["text"])
+    
     @room.on("data_received")
     def on_data_received(data: rtc.DataPacket):
         print(f"📨 Data received: {data.topic}")
-        if data.topic == "audio_alert":
+        if data.topic == ALERT_REF_TOPIC:
+            try:
+                ref = decode_alert_ref(data.data)
+            except ValueError as e:
+                print(f"❌ Bad alert reference: {e}")
+                return
+            print(f"🚨 Alert: {ref['text']}")
+            path = clip_cache.lookup(ref["sha256"])
+            if path is not None:
+                start_audio_thread(play_cached_clip, path, ref["text"])
+            elif clip_cache.wait_for(ref) and data.participant is not None:
+                print(f"📥 Clip {ref['clip']} not cached, requesting it")
+                asyncio.create_task(room.local_participant.publish_data(
+                    payload=encode_clip_request(ref["sha256"]), topic=CLIP_REQUEST_TOPIC,
+                    reliable=True, destination_identities=[data.participant.identity],
+                ))
+                loop.call_later(clip_timeout, on_clip_timeout, ref["sha256"])
+        elif data.topic == CLIP_TOPIC:
+            path, refs = clip_cache.store(data.data)
+            print(f"💾 Cached alert clip ({len(data.data)} bytes)")
+            for ref in refs:
+                start_audio_thread(play_cached_clip, path, ref["text"])
+        elif data.topic == "audio_alert":
             mp3_data = data.data
             print(f"🎵 MP3 alert received ({len(mp3_data)} bytes)")
             audio_thread = threading.Thread(target=play_mp3_alert, args=(mp3_data,))
@@ -100,7 +136,7 @@ async def publish_stream():
             print(f"🎵 Started audio thread for text alert")
     
     url = os.getenv("LIVEKIT_URL")
-    token = generate_token(identity="copilot-officer", name="Copilot Officer", roomName="copilot-room")
+    token = get_token("copilot-officer", "Copilot Officer", "copilot-room")
 
     # Debug connection info
     print(f"🔗 Connecting to LiveKit server: {url}")
@@ -119,7 +155,8 @@ async def publish_stream():
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
     video_source = rtc.VideoSource(640, 480)
     video_track = rtc.LocalVideoTrack.create_video_track("webcam", video_source)
-    await room.local_participant.publish_track(video_track)
+    await room.local_participant.publish_track(
+        video_track, rtc.TrackPublishOptions(source=rtc.TrackSource.SOURCE_CAMERA))
     print("📹 Video track published")
 
     # Audio track
@@ -127,7 +164,8 @@ async def publish_stream():
     stream = p.open(format=pyaudio.paInt16, channels=1, rate=48000, input=True, frames_per_buffer=1024)
     audio_source = rtc.AudioSource(48000, 1)
     audio_track = rtc.LocalAudioTrack.create_audio_track("mic", audio_source)
-    await room.local_participant.publish_track(audio_track)
+    await room.local_participant.publish_track(
+        audio_track, rtc.TrackPublishOptions(source=rtc.TrackSource.SOURCE_MICROPHONE))
     print("🎙️ Audio track published")
 
     # Ready to receive alerts
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Event loop lag watchdog for server.py.
+
+A sampling task sleeps LOOP_LAG_INTERVAL_S at a time and records how late it
+wakes up: that lateness is the delay every other track saw at the same moment.
+Lags go to the copilot_loop_lag_seconds histogram, and the p50/p95/p99/max
+of the last LOOP_LAG_WINDOW samples are printed and exported as gauges.
+
+Lag sampling alone is the default. To say *what* stalled the loop, set
+LOOP_SLOW_CALLBACK_S (e.g. 0.1) while investigating: every callback on a
+watched loop is then timed, and one that runs longer than that is logged
+with its task name (server.py names track tasks "video <identity> <sid>"
+and so on), its coroutine and the line it next awaits at, and counted per
+coroutine. This replaces asyncio's Handle._run for the whole process and
+reads private Handle / Task internals, so it is CPython-specific, and while
+any loop is watched every callback on every loop pays a dict lookup. It is
+meant as a diagnostic, not left on; the patch is undone when the last
+watched loop's watchdog stops.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import LOOP_LAG, LOOP_LAG_QUANTILES, SLOW_CALLBACK_SECONDS, SLOW_CALLBACKS
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_watchdogs = {}  # loop -> LoopWatchdog timing that loop's callbacks
+_install_lock = threading.Lock()
+_handle_run = None  # The original asyncio Handle._run, once patched
+
+
+def _timed_run(self):
+    watchdog = _watchdogs.get(self._loop)
+    if watchdog is None:
+        return _handle_run(self)
+    started = time.perf_counter()
+    try:
+        return _handle_run(self)
+    finally:
+        elapsed = time.perf_counter() - started
+        if elapsed >= watchdog.slow_threshold:
+            watchdog.record_slow(self, elapsed)
+
+
+def _watch_loop(loop, watchdog):
+    """Time loop's callbacks for watchdog; asyncio.Handle is patched on first use"""
+    global _handle_run
+    with _install_lock:
+        if _handle_run is None:
+            _handle_run = asyncio.events.Handle._run
+            asyncio.events.Handle._run = _timed_run
+        _watchdogs[loop] = watchdog
+
+
+def _unwatch_loop(loop):
+    global _handle_run
+    with _install_lock:
+        _watchdogs.pop(loop, None)
+        if not _watchdogs and _handle_run is not None:
+            asyncio.events.Handle._run = _handle_run
+            _handle_run = None
+
+
+def describe_callback(handle):
+    """(coroutine or function name, readable description) of what a Handle runs"""
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        frame = getattr(coro, "cr_frame", None)
+        where = f" -> {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}" if frame is not None else " (finished)"
+        return name, f"task '{task.get_name()}' ({name}{where})"
+    name = getattr(callback, "__qualname__", None) or repr(callback)
+    return name, f"callback {name}"
+
+
+class LoopWatchdog:
+    """Samples one event loop's lag and attributes the callbacks that block it"""
+
+    def __init__(self, room_name="", interval=None, slow_threshold=None, window=None, log_interval=None):
+        self.room_name = room_name
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL_S", "0.05"))
+        self.slow_threshold = slow_threshold if slow_threshold is not None else float(
+            os.getenv("LOOP_SLOW_CALLBACK_S", "0"))
+        self.lags = deque(maxlen=window or int(os.getenv("LOOP_LAG_WINDOW", "1200")))
+        self.log_interval = log_interval if log_interval is not None else float(os.getenv("LOOP_SLOW_LOG_INTERVAL_S", "10"))
+        self.slow = {}  # coroutine / function name -> [count, total seconds, worst seconds]
+        self._logged = {}  # name -> (monotonic time of the last log line, callbacks not logged since)
+
+    def record_slow(self, handle, elapsed):
+        name, description = describe_callback(handle)
+        stat = self.slow.get(name)
+        if stat is None:
+            self.slow[name] = [1, elapsed, elapsed]
+        else:
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+        SLOW_CALLBACKS.inc(room=self.room_name, coroutine=name)
+        SLOW_CALLBACK_SECONDS.inc(elapsed, room=self.room_name, coroutine=name)
+
+        # A stall that repeats every frame is logged once per log_interval, with a count of the rest
+        now = time.monotonic()
+        last, suppressed = self._logged.get(name, (float("-inf"), 0))
+        if now - last < self.log_interval:
+            self._logged[name] = (last, suppressed + 1)
+            return
+        self._logged[name] = (now, 0)
+        more = f" (+{suppressed} more since last report)" if suppressed else ""
+        print(f"🐢 Event loop blocked {elapsed * 1000:.0f}ms by {description}{more}")
+
+    def percentiles(self):
+        """{quantile: lag seconds} over the recent window, plus "max" """
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        result = {q: lags[min(len(lags) - 1, int(q * len(lags)))] for q in QUANTILES}
+        result["max"] = lags[-1]
+        return result
+
+    def summary(self):
+        stats = self.percentiles()
+        if not stats:
+            return "no lag samples yet"
+        parts = [f"p{int(q * 100)}={stats[q] * 1000:.1f}ms" for q in QUANTILES]
+        parts.append(f"max={stats['max'] * 1000:.1f}ms")
+        worst = sorted(self.slow.items(), key=lambda item: item[1][1], reverse=True)[:3]
+        if worst:
+            parts.append("slowest: " + ", ".join(f"{name} x{count} ({total:.2f}s)" for name, (count, total, _) in worst))
+        return " ".join(parts)
+
+    async def run(self):
+        """Sample lag until cancelled; with a slow_threshold, callbacks on this loop are timed meanwhile"""
+        loop = asyncio.get_running_loop()
+        if self.slow_threshold > 0:
+            _watch_loop(loop, self)
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+                self.lags.append(lag)
+                LOOP_LAG.observe(lag, room=self.room_name)
+        finally:
+            _unwatch_loop(loop)
+
+    async def report(self, interval):
+        """Periodically export the lag percentiles and print them"""
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.percentiles()
+            for quantile, lag in stats.items():
+                LOOP_LAG_QUANTILES.set(lag, room=self.room_name, quantile=str(quantile))
+            if stats:
+                print(f"🕒 Loop lag {self.summary()}")
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Prometheus-style metrics for server.py, served over local HTTP.
+
+A deliberately small, dependency-free registry: counters, gauges and
+histograms with labels, rendered in the Prometheus text exposition format at
+http://127.0.0.1:METRICS_PORT/metrics (METRICS_PORT=0 turns the endpoint off).
+Updates take one lock per metric, so they are safe from the event loop,
+analysis threads and per-room loops alike.
+
+Other modules can contribute extra exposition lines through
+REGISTRY.add_collector(), which is how profiling histograms are exported.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+AUDIO_LEVEL_BUCKETS = (100, 200, 400, 800, 1600, 3200, 6400, 12800, 32768)  # RMS of int16 samples
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+    def remove(self, **labels):
+        """Forget every series whose labels match the given ones (e.g. a track that ended)"""
+        match = [(self.labels.index(name), value) for name, value in labels.items()]
+        with self.lock:
+            for key in [k for k in self.values if all(k[i] == v for i, v in match)]:
+                del self.values[key]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = format_labels(self.labels, key, [("le", format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect):
+        """Register a callable returning extra exposition lines at scrape time"""
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collect in self.collectors:
+            lines += collect()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+TRACK_LABELS = ("room", "participant", "track", "kind")
+
+FRAMES_RECEIVED = REGISTRY.counter(
+    "copilot_frames_received_total", "Media frames received from subscribed tracks", TRACK_LABELS)
+FRAMES_ANALYZED = REGISTRY.counter(
+    "copilot_frames_analyzed_total", "Frames (video) or audio blocks run through a detector", TRACK_LABELS)
+FRAMES_DROPPED = REGISTRY.counter(
+    "copilot_frames_dropped_total",
+    "Frames not analyzed: sampled_out (frame schedule), stale (replaced while waiting), overrun (analyzer ring lapped)",
+    TRACK_LABELS + ("reason",))
+ANALYSIS_SECONDS = REGISTRY.histogram(
+    "copilot_analysis_seconds", "Motion analysis time per video frame (mode: thread, batch or process)", ("room", "mode"))
+AUDIO_LEVEL = REGISTRY.histogram(
+    "copilot_audio_level_rms", "Loudest VAD window RMS per processed audio block", ("room", "participant"),
+    AUDIO_LEVEL_BUCKETS)
+ALERTS_SENT = REGISTRY.counter(
+    "copilot_alerts_sent_total", "Alerts delivered, per recipient (room = broadcast)", ("room", "kind", "destination"))
+PAYLOAD_BYTES = REGISTRY.counter(
+    "copilot_payload_bytes_total", "Data channel payload bytes published, per topic", ("room", "topic"))
+ALERT_QUEUE_DEPTH = REGISTRY.gauge(
+    "copilot_alert_queue_depth", "Alerts waiting in the dispatcher queue", ("room",))
+LOOP_LAG = REGISTRY.histogram(
+    "copilot_loop_lag_seconds", "How late the event loop woke a sleeping task", ("room",), LOOP_LAG_BUCKETS)
+LOOP_LAG_QUANTILES = REGISTRY.gauge(
+    "copilot_loop_lag_quantile_seconds", "Event loop lag percentiles over the recent sample window", ("room", "quantile"))
+SLOW_CALLBACKS = REGISTRY.counter(
+    "copilot_slow_callbacks_total", "Event loop callbacks or task steps longer than LOOP_SLOW_CALLBACK_S",
+    ("room", "coroutine"))
+SLOW_CALLBACK_SECONDS = REGISTRY.counter(
+    "copilot_slow_callback_seconds_total", "Time the event loop spent in slow callbacks", ("room", "coroutine"))
+LIVE_TRACKS = REGISTRY.gauge(
+    "copilot_live_tracks", "Subscribed tracks with running analysis", ("room", "kind"))
+
+
+def forget_track(sid):
+    """Drop every per-track series of a track that has ended, so churn does not grow the registry"""
+    for metric in (FRAMES_RECEIVED, FRAMES_ANALYZED, FRAMES_DROPPED):
+        metric.remove(track=sid)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404, "metrics are at /metrics")
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown the console
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread; once per process, later calls are no-ops"""
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"❌ Metrics endpoint unavailable on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        print(f"📈 Metrics at http://{host}:{port}/metrics")
+        return _server
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Motion analysis for server.py video tracks.
+
+MotionAnalyzer holds one track's working buffers and background model and
+does all of the OpenCV work for a frame in a single synchronous call, so it
+can run on an executor thread (OpenCV releases the GIL) while the event loop
+keeps receiving frames and sending alerts.
+"""
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import cv2
+from livekit import rtc
+
+from background_models import create_background_model
+
+# Formats whose first plane is the full-resolution 8-bit Y (luma) plane
+LUMA_PLANE_TYPES = (
+    rtc.VideoBufferType.I420,
+    rtc.VideoBufferType.I420A,
+    rtc.VideoBufferType.I422,
+    rtc.VideoBufferType.I444,
+    rtc.VideoBufferType.NV12,
+)
+
+
+def luma_view(frame):
+    """Return the frame's luma as a (height, width) uint8 array.
+
+    YUV frames are read straight out of the Y plane as a NumPy view, with no
+    copy or colour conversion. Any other format is converted to I420 by the
+    FFI first. VideoStream normalizes strides, so the Y plane is exactly
+    width * height bytes at the start of the buffer.
+    """
+    if frame.type not in LUMA_PLANE_TYPES:
+        frame = frame.convert(rtc.VideoBufferType.I420)
+    y_plane = np.frombuffer(frame.data, dtype=np.uint8, count=frame.width * frame.height)
+    return y_plane.reshape((frame.height, frame.width))
+
+
+MAX_GRID_CELLS = 255  # Grid rows / cols per side; one byte each in the heatmap payload
+
+
+@dataclass
+class MotionConfig:
+    """Motion analysis settings.
+
+    Analysis runs on a downscaled copy of the luma plane, and motion is
+    measured on a grid_cols x grid_rows grid of cells over it. A cell is active
+    when at least `min_cell_motion` of its pixels changed (at the default 10x10
+    px cells that is about the old 500px contour at 640x480), and a frame has
+    motion when the active cells cover more than `min_motion_area` of the
+    analyzed area (the old 2000px at 640x480). The motion_heatmap payload
+    stores rows and cols in one byte each, so the grid is at most
+    MAX_GRID_CELLS a side.
+    """
+    analysis_width: int = 160
+    analysis_height: int = 120
+    grid_cols: int = 16
+    grid_rows: int = 12
+    min_cell_motion: float = 0.3
+    min_motion_area: float = 0.0065
+    background_model: str = "running_average"
+    roi_dir: str = ""
+
+    def __post_init__(self):
+        for name in ("grid_cols", "grid_rows"):
+            value = getattr(self, name)
+            if not 1 <= value <= MAX_GRID_CELLS:
+                raise ValueError(f"Motion {name} must be between 1 and {MAX_GRID_CELLS}, got {value}")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            analysis_width=int(os.getenv("MOTION_ANALYSIS_WIDTH", cls.analysis_width)),
+            analysis_height=int(os.getenv("MOTION_ANALYSIS_HEIGHT", cls.analysis_height)),
+            grid_cols=int(os.getenv("MOTION_GRID_COLS", cls.grid_cols)),
+            grid_rows=int(os.getenv("MOTION_GRID_ROWS", cls.grid_rows)),
+            min_cell_motion=float(os.getenv("MOTION_MIN_CELL_MOTION", cls.min_cell_motion)),
+            min_motion_area=float(os.getenv("MOTION_MIN_TOTAL_AREA", cls.min_motion_area)),
+            background_model=os.getenv("MOTION_BACKGROUND_MODEL", cls.background_model),
+            roi_dir=os.getenv("MOTION_ROI_DIR", cls.roi_dir),
+        )
+
+    def grid_shape(self, height, width):
+        """(rows, cols) of the motion grid for an analyzed frame, at least 1px per cell"""
+        return min(self.grid_rows, height), min(self.grid_cols, width)
+
+    def analysis_size(self, width, height):
+        """Fit (width, height) inside the working resolution, keeping aspect ratio and never upscaling"""
+        scale = min(self.analysis_width / width, self.analysis_height / height, 1.0)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def blur_kernel(width):
+    """Gaussian kernel scaled from the original 21x21 at 640px wide (always odd)"""
+    k = max(3, round(21 * width / 640))
+    return (k | 1, k | 1)
+
+
+def load_roi_mask(identity, roi_dir):
+    """Load the static ROI mask for a participant, or None if it has none.
+
+    Masks are images in `roi_dir` named <identity>.png (falling back to
+    default.png). Non-zero pixels are analyzed; zero pixels (a dashboard, the
+    hood of the car) are ignored. Any size works, it is resized to the
+    analysis resolution.
+    """
+    if not roi_dir:
+        return None
+    for name in (f"{identity}.png", "default.png"):
+        path = os.path.join(roi_dir, name)
+        if os.path.exists(path):
+            mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                print(f"❌ Could not read ROI mask: {path}")
+                return None
+            print(f"🎯 Using ROI mask {path} for {identity}")
+            return mask
+    return None
+
+
+def fit_roi(roi, shape):
+    """Resize an ROI mask to an analysis shape as a boolean array"""
+    return cv2.resize(roi, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST) > 0
+
+
+def cell_energy(changed, grid_shape):
+    """Fraction of changed pixels in each grid cell.
+
+    `changed` is a (..., height, width) boolean or 0/1 array; the result is
+    (..., rows, cols) float32. Pixels past the last whole cell are ignored.
+    """
+    rows, cols = grid_shape
+    height, width = changed.shape[-2:]
+    ch, cw = height // rows, width // cols
+    cells = changed[..., :rows * ch, :cols * cw].reshape(changed.shape[:-2] + (rows, ch, cols, cw))
+    counts = cells.sum(axis=(-3, -1), dtype=np.uint32)
+    return counts.astype(np.float32) / (ch * cw)
+
+
+def heatmap_bytes(heatmap):
+    """Quantize a heatmap to one byte per cell for compact payloads"""
+    return np.clip(heatmap * 255, 0, 255).astype(np.uint8).tobytes()
+
+
+@dataclass
+class MotionResult:
+    regions: int
+    motion_fraction: float
+    has_motion: bool
+    heatmap: Optional[np.ndarray] = None  # (rows, cols) fraction of changed pixels per cell
+
+
+def score_heatmap(heatmap, config, analyzed_area, cell_area):
+    """Turn cell energies into (active cells, motion fraction, has motion)"""
+    active = heatmap >= config.min_cell_motion
+    regions = int(active.sum())
+    motion_fraction = float(heatmap[active].sum()) * cell_area / analyzed_area if analyzed_area else 0.0
+    return regions, motion_fraction, regions > 0 and motion_fraction > config.min_motion_area
+
+
+class MotionAnalyzer:
+    """Per-track motion analysis state: downscale/blur buffers plus the background model"""
+
+    def __init__(self, config: Optional[MotionConfig] = None, roi=None, timings=None):
+        self.config = config or MotionConfig.from_env()
+        self.timings = timings  # Optional profiling.StageTimings
+        self.background = create_background_model(self.config.background_model)
+        self.roi = roi
+        self.roi_small = None
+        self.small = None
+        self.blurred = None
+
+    def downscale(self, gray):
+        """Resize luma to the working resolution, reusing the track's buffer when its shape still fits"""
+        width, height = self.config.analysis_size(gray.shape[1], gray.shape[0])
+        if (width, height) == (gray.shape[1], gray.shape[0]):
+            return gray
+        if self.small is None or self.small.shape != (height, width):
+            self.small = np.empty((height, width), dtype=np.uint8)
+        cv2.resize(gray, (width, height), dst=self.small, interpolation=cv2.INTER_AREA)
+        return self.small
+
+    def analyze(self, frame):
+        """Run the full motion pipeline on a VideoFrame; returns None while the background warms up"""
+        timings = self.timings
+        if timings is not None:
+            timings.start()
+        gray = luma_view(frame)
+        if timings is not None:
+            timings.lap("luma")
+        return self._analyze(gray)
+
+    def analyze_luma(self, gray):
+        """Run the full motion pipeline on a (height, width) uint8 luma array"""
+        if self.timings is not None:
+            self.timings.start()
+        return self._analyze(gray)
+
+    def _analyze(self, gray):
+        timings = self.timings
+        small = self.downscale(gray)
+        if timings is not None:
+            timings.lap("downscale")
+        self.blurred = cv2.GaussianBlur(small, blur_kernel(small.shape[1]), 0, dst=self.blurred)
+        frame_area = small.shape[0] * small.shape[1]
+        if timings is not None:
+            timings.lap("blur")
+
+        mask = self.background.apply(self.blurred)
+        if timings is not None:
+            timings.lap("background")
+        if mask is None:
+            return None
+        analyzed_area = frame_area
+        if self.roi is not None:
+            if self.roi_small is None or self.roi_small.shape != mask.shape:
+                self.roi_small = fit_roi(self.roi, mask.shape).astype(np.uint8) * 255
+            cv2.bitwise_and(mask, self.roi_small, dst=mask)
+            analyzed_area = int(np.count_nonzero(self.roi_small))
+
+        grid = self.config.grid_shape(*mask.shape)
+        heatmap = cell_energy(mask, grid) / 255
+        cell_area = (mask.shape[0] // grid[0]) * (mask.shape[1] // grid[1])
+        regions, motion_fraction, has_motion = score_heatmap(heatmap, self.config, analyzed_area, cell_area)
+        if timings is not None:
+            timings.lap("grid")
+        return MotionResult(regions, motion_fraction, has_motion, heatmap)
+
+
+class MotionAlertState:
+    """Per-track alert decision: a sliding window of motion flags plus a cooldown.
+
+    An alert fires once the window is full and at least `min_hits` of its
+    frames had motion, no more often than every `cooldown` seconds.
+    """
+
+    def __init__(self, window=5, min_hits=2, cooldown=8.0):
+        self.history = deque(maxlen=window)
+        self.min_hits = min_hits
+        self.cooldown = cooldown
+        self.last_alert_time = float("-inf")  # The first alert is never held back, whatever clock `now` uses
+
+    def update(self, has_motion, now):
+        """Record one analyzed frame; returns True when an alert should be sent"""
+        self.history.append(has_motion)
+        if len(self.history) < self.history.maxlen or sum(self.history) < self.min_hits:
+            return False
+        if (now - self.last_alert_time) <= self.cooldown:
+            return False
+        self.last_alert_time = now
+        self.history.clear()
+        return True
+
+
+class FrameSampler:
+    """Wall-clock sampling schedule for one video track.
+
+    Frames are analyzed at `idle_fps` until motion is seen, then at
+    `active_fps` for `active_hold` seconds after the last motion. If the
+    smoothed analysis time (including any wait for a worker) goes over
+    `budget`, the interval is stretched by up to `max_backoff` times and
+    relaxed again once analysis is comfortably back under budget. The
+    publisher's frame rate no longer matters.
+    """
+
+    def __init__(self, idle_fps=2.0, active_fps=10.0, active_hold=5.0, budget=0.025, max_backoff=8.0):
+        self.idle_fps = idle_fps
+        self.active_fps = active_fps
+        self.active_hold = active_hold
+        self.budget = budget
+        self.max_backoff = max_backoff
+        self.backoff = 1.0
+        self.processing_time = 0.0
+        self.active_until = 0.0
+        self.next_due = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            idle_fps=float(os.getenv("MOTION_IDLE_FPS", "2")),
+            active_fps=float(os.getenv("MOTION_ACTIVE_FPS", "10")),
+            active_hold=float(os.getenv("MOTION_ACTIVE_HOLD_S", "5")),
+            budget=float(os.getenv("ANALYSIS_BUDGET_MS", "25")) / 1000,
+        )
+
+    def rate(self, now):
+        fps = self.active_fps if now < self.active_until else self.idle_fps
+        return fps / self.backoff
+
+    def should_sample(self, now):
+        """True if a frame arriving at `now` should be analyzed"""
+        if now < self.next_due:
+            return False
+        self.next_due = now + 1.0 / self.rate(now)
+        return True
+
+    def record(self, has_motion, processing_time, now):
+        """Feed back one analysis result and how long it took (None if unknown)"""
+        if has_motion:
+            self.active_until = now + self.active_hold
+            # Step up straight away instead of waiting out an idle interval
+            self.next_due = min(self.next_due, now + 1.0 / self.rate(now))
+        if processing_time is not None:
+            self.processing_time = 0.8 * self.processing_time + 0.2 * processing_time
+            if self.processing_time > self.budget:
+                self.backoff = min(self.backoff * 1.5, self.max_backoff)
+            elif self.processing_time < self.budget / 2:
+                self.backoff = max(self.backoff / 1.25, 1.0)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Batched motion analysis across every video track in the room.
+
+Instead of one analysis call per track per frame, server.py can collect the
+latest frame of every active track on a fixed tick and hand them all to
+BatchMotionAnalyzer.analyze(). Each frame is downscaled and blurred straight
+into its row of a preallocated (tracks, height, width) stack, then the
+background update, diff, threshold and motion statistics run as a handful of
+NumPy operations over the whole stack, so the per-frame Python overhead is
+paid once per batch rather than once per stream.
+
+Tracks are grouped by analysis shape (tracks with different aspect ratios end
+up in different stacks). The background model is a running average, the
+vectorized equivalent of background_models.RunningAverageModel. The motion
+grid, ROI masks and scoring are the same as MotionAnalyzer's.
+"""
+import os
+from collections import deque
+
+import numpy as np
+import cv2
+
+from background_models import DIFF_THRESHOLD
+from motion import MotionResult, blur_kernel, cell_energy, fit_roi, luma_view, score_heatmap
+
+
+class _BatchGroup:
+    """Preallocated stacks for all tracks that share one analysis shape"""
+
+    def __init__(self, shape, capacity=4):
+        self.shape = shape
+        self.free = []
+        self.capacity = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        height, width = self.shape
+        old = self.capacity
+        frames = np.zeros((capacity, height, width), dtype=np.uint8)
+        background = np.zeros((capacity, height, width), dtype=np.float32)
+        seeded = np.zeros(capacity, dtype=bool)
+        roi = np.ones((capacity, height, width), dtype=bool)
+        if old:
+            frames[:old] = self.frames
+            background[:old] = self.background
+            seeded[:old] = self.seeded
+            roi[:old] = self.roi
+        self.frames, self.background, self.seeded, self.roi = frames, background, seeded, roi
+        self.delta = np.empty((capacity, height, width), dtype=np.float32)
+        self.step = np.empty((capacity, height, width), dtype=np.float32)
+        self.changed = np.empty((capacity, height, width), dtype=bool)
+        self.weights = np.zeros((capacity, 1, 1), dtype=np.float32)
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def acquire(self, roi=None):
+        if not self.free:
+            self._allocate(self.capacity * 2)
+        row = self.free.pop()
+        self.seeded[row] = False
+        self.roi[row] = fit_roi(roi, self.shape) if roi is not None else True
+        return row
+
+    def release(self, row):
+        self.free.append(row)
+
+
+class _BatchTrack:
+    def __init__(self, roi=None):
+        self.roi = roi
+        self.small = None
+        self.group = None
+        self.row = None
+
+
+class BatchMotionAnalyzer:
+    """Motion analysis for many tracks in one vectorized pass"""
+
+    def __init__(self, config, alpha=None, timings=None):
+        self.config = config
+        self.timings = timings  # Optional profiling.StageTimings; laps cover the whole batch
+        self.alpha = alpha if alpha is not None else float(os.getenv("MOTION_BACKGROUND_ALPHA", "0.05"))
+        self.groups = {}
+        self.tracks = {}
+        self._ops = deque()  # ("add", track_id, roi) / ("remove", track_id, None), applied in order
+
+    def add(self, track_id, roi=None):
+        """Register a track with an optional static ROI mask (see motion.load_roi_mask)"""
+        self._ops.append(("add", track_id, roi))
+
+    def remove(self, track_id):
+        """Forget a track; applied at the start of the next analyze() so it is safe from the event loop"""
+        self._ops.append(("remove", track_id, None))
+
+    def _apply_ops(self):
+        # In submission order, so a remove followed by an add of the same SID (a resubscribe) keeps the new track
+        while self._ops:
+            op, track_id, roi = self._ops.popleft()
+            track = self.tracks.pop(track_id, None)
+            if track is not None and track.group is not None:
+                track.group.release(track.row)
+            if op == "add":
+                self.tracks[track_id] = _BatchTrack(roi)
+
+    def _place(self, track_id, gray):
+        """Downscale + blur a track's luma into its row of the right group; returns (group, row) or None if unregistered"""
+        track = self.tracks.get(track_id)
+        if track is None:
+            return None
+        width, height = self.config.analysis_size(gray.shape[1], gray.shape[0])
+        if track.group is None or track.group.shape != (height, width):
+            if track.group is not None:
+                track.group.release(track.row)
+            group = self.groups.get((height, width))
+            if group is None:
+                group = self.groups[(height, width)] = _BatchGroup((height, width))
+            track.group, track.row = group, group.acquire(track.roi)
+        small = gray
+        if (width, height) != (gray.shape[1], gray.shape[0]):
+            if track.small is None or track.small.shape != (height, width):
+                track.small = np.empty((height, width), dtype=np.uint8)
+            cv2.resize(gray, (width, height), dst=track.small, interpolation=cv2.INTER_AREA)
+            small = track.small
+        cv2.GaussianBlur(small, blur_kernel(width), 0, dst=track.group.frames[track.row])
+        return track.group, track.row
+
+    def analyze(self, frames):
+        """Analyze {track_id: VideoFrame}; returns {track_id: MotionResult or None while warming up}"""
+        self._apply_ops()
+
+        timings = self.timings
+        if timings is not None:
+            timings.start()
+        fresh = {}
+        for track_id, frame in frames.items():
+            placed = self._place(track_id, luma_view(frame))
+            if placed is None:  # Removed after its frame was taken
+                continue
+            group, row = placed
+            fresh.setdefault(group, []).append((track_id, row))
+        if timings is not None:
+            timings.lap("place")
+
+        results = {}
+        for group, members in fresh.items():
+            rows = np.array([row for _, row in members])
+            warming = rows[~group.seeded[rows]]
+            group.background[warming] = group.frames[warming]
+            group.seeded[warming] = True
+
+            # Only rows with a new frame move their background
+            group.weights.fill(0)
+            group.weights[rows] = self.alpha
+            np.subtract(group.frames, group.background, out=group.delta)
+            np.multiply(group.delta, group.weights, out=group.step)
+            group.background += group.step
+            np.abs(group.delta, out=group.delta)
+            np.greater(group.delta, DIFF_THRESHOLD, out=group.changed)
+            np.logical_and(group.changed, group.roi, out=group.changed)
+            if timings is not None:
+                timings.lap("background")
+
+            height, width = group.shape
+            grid = self.config.grid_shape(height, width)
+            cell_area = (height // grid[0]) * (width // grid[1])
+            heatmaps = cell_energy(group.changed[rows], grid)
+            analyzed_areas = group.roi[rows].reshape(len(rows), -1).sum(axis=1)
+
+            warmed = set(warming.tolist())
+            for i, (track_id, row) in enumerate(members):
+                if row in warmed:
+                    results[track_id] = None
+                    continue
+                regions, fraction, has_motion = score_heatmap(heatmaps[i], self.config, int(analyzed_areas[i]), cell_area)
+                results[track_id] = MotionResult(regions, fraction, has_motion, heatmaps[i])
+            if timings is not None:
+                timings.lap("grid")
+        return results
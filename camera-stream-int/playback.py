@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Real-time PCM publishing for server.py.
+
+PcmPlayer feeds any source of int16 PCM blocks (a decoded file, a generator,
+an async stream) into an rtc.AudioSource in WebRTC-sized 10 ms frames. Frame
+i is due at start + i * 10 ms on the event loop's monotonic clock, so time
+spent decoding or capturing never accumulates as drift. The player keeps
+about `lead` seconds queued in the AudioSource: enough to ride out a slow
+block without underrunning, little enough that the published track stays
+close to real time.
+
+Lag is how late a frame was handed over relative to its deadline. If it
+grows past `max_lag` (the source stalled) the schedule is rebased rather
+than bursting to catch up.
+"""
+import asyncio
+from dataclasses import dataclass
+
+import numpy as np
+from livekit import rtc
+
+FRAME_MS = 10
+
+
+@dataclass
+class PlaybackStats:
+    frames: int = 0
+    underruns: int = 0  # Frames captured after the AudioSource queue had run dry
+    resyncs: int = 0  # Times the schedule was rebased after a stall
+    lag: float = 0.0  # Seconds behind schedule at the last frame
+    max_lag: float = 0.0
+
+    def summary(self):
+        return (f"{self.frames} frames ({self.frames * FRAME_MS / 1000:.1f}s), lag={self.lag * 1000:.1f}ms "
+                f"max_lag={self.max_lag * 1000:.1f}ms underruns={self.underruns} resyncs={self.resyncs}")
+
+
+async def _iterate(blocks):
+    """Iterate a sync or async iterable of PCM blocks"""
+    if hasattr(blocks, "__aiter__"):
+        async for block in blocks:
+            yield block
+    else:
+        for block in blocks:
+            yield block
+
+
+class PcmPlayer:
+    """Paces int16 PCM into an rtc.AudioSource on a drift-free 10 ms schedule"""
+
+    def __init__(self, audio_source, lead=0.1, max_lag=0.5, report_interval=10.0, name="audio"):
+        self.source = audio_source
+        self.lead = lead
+        self.max_lag = max_lag
+        self.report_interval = report_interval
+        self.name = name
+        self.samples_per_frame = audio_source.sample_rate * FRAME_MS // 1000
+        self.stats = PlaybackStats()
+
+    async def _frames(self, blocks):
+        """Regroup blocks of any size into exact 10 ms frames; the last one is zero padded.
+
+        The same AudioFrame is refilled for every frame, which is safe because
+        capture_frame() has copied the data by the time it returns.
+        """
+        channels = self.source.num_channels
+        frame = rtc.AudioFrame.create(self.source.sample_rate, channels, self.samples_per_frame)
+        buffer = np.frombuffer(frame.data, dtype=np.int16)
+        filled = 0
+        async for block in _iterate(blocks):
+            samples = np.asarray(block, dtype=np.int16).reshape(-1)
+            offset = 0
+            while offset < samples.size:
+                n = min(buffer.size - filled, samples.size - offset)
+                buffer[filled:filled + n] = samples[offset:offset + n]
+                filled += n
+                offset += n
+                if filled == buffer.size:
+                    yield frame
+                    filled = 0
+        if filled:
+            buffer[filled:] = 0
+            yield frame
+
+    async def play(self, blocks):
+        """Publish every block in real time; returns the PlaybackStats"""
+        loop = asyncio.get_running_loop()
+        frame_duration = FRAME_MS / 1000
+        stats = self.stats
+        start = None
+        next_report = loop.time() + self.report_interval
+        async for frame in self._frames(blocks):
+            now = loop.time()
+            if start is None:
+                start = now
+            due = start + stats.frames * frame_duration
+            # Stay `lead` ahead of the deadline, and never queue more than `lead` in the source
+            wait = max(due - self.lead - now, self.source.queued_duration - self.lead)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = loop.time()
+            lag = now - due
+            if lag > self.max_lag:
+                start += lag
+                stats.resyncs += 1
+            if stats.frames and self.source.queued_duration == 0:
+                stats.underruns += 1
+            stats.lag = max(lag, 0.0)
+            stats.max_lag = max(stats.max_lag, stats.lag)
+            await self.source.capture_frame(frame)
+            stats.frames += 1
+            if now >= next_report:
+                print(f"🎵 Playback {self.name}: {stats.summary()}")
+                next_report = now + self.report_interval
+        await self.source.wait_for_playout()
+        return stats
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Per-stage timing for the analysis pipelines.
+
+StageTimings keeps count / total / max and a latency histogram per stage.
+replay.py uses one directly; server.py asks pipeline_timings() for a shared
+instance per pipeline ("video", "audio"), which exists only when
+PROFILE_STAGES=1, so the timing calls cost nothing in normal runs. Shared
+pipelines are exported as the copilot_stage_seconds histogram on the metrics
+endpoint and printed by dump_pipelines() (on SIGUSR1 in server.py).
+"""
+import bisect
+import os
+import threading
+import time
+
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class StageTimings:
+    """Accumulates wall time per pipeline stage.
+
+    Call start() at the top of a pipeline run and lap(stage) after each stage;
+    each lap is charged the time since the previous start() or lap() on the
+    same thread, so one instance can be shared by analyzers running in
+    different threads.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.stats = {}  # stage -> [count, total seconds, max seconds]
+        self.histograms = {}  # stage -> counts per bucket, plus one for +Inf
+        self._mark = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._mark.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self._mark.last
+        self._mark.last = now
+        index = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            stat = self.stats.get(stage)
+            if stat is None:
+                self.stats[stage] = [1, elapsed, elapsed]
+                self.histograms[stage] = [0] * (len(self.buckets) + 1)
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+                if elapsed > stat[2]:
+                    stat[2] = elapsed
+            self.histograms[stage][index] += 1
+
+    def percentile(self, stage, q):
+        """Upper bucket bound below which a fraction q of the stage's laps fall"""
+        with self._lock:
+            counts = list(self.histograms.get(stage, ()))
+        total = sum(counts)
+        if not total:
+            return 0.0
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        """Lines of `stage: mean / p95 / max ms (count)` in pipeline order"""
+        lines = []
+        with self._lock:
+            stats = [(stage, *stat) for stage, stat in self.stats.items()]
+        for stage, count, total, worst in stats:
+            lines.append(f"{stage:>14}: mean={total / count * 1000:7.3f}ms  p95<={self.percentile(stage, 0.95) * 1000:7.3f}ms  "
+                         f"max={worst * 1000:7.3f}ms  n={count}")
+        return lines
+
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def profiling_enabled():
+    return os.getenv("PROFILE_STAGES", "0") == "1"
+
+
+def pipeline_timings(name):
+    """The shared StageTimings for a pipeline, or None when PROFILE_STAGES is off"""
+    if not profiling_enabled():
+        return None
+    with _pipelines_lock:
+        if not _pipelines:
+            from metrics import REGISTRY
+            REGISTRY.add_collector(prometheus_lines)
+        timings = _pipelines.get(name)
+        if timings is None:
+            timings = _pipelines[name] = StageTimings()
+        return timings
+
+
+def dump_pipelines():
+    """Print every shared pipeline's stage summary"""
+    with _pipelines_lock:
+        pipelines = list(_pipelines.items())
+    for name, timings in pipelines:
+        print(f"⏱️  {name} pipeline stages:")
+        for line in timings.summary():
+            print(f"   {line}")
+
+
+def prometheus_lines():
+    """Shared pipelines as the copilot_stage_seconds histogram, in Prometheus text format"""
+    from metrics import format_labels, format_value
+
+    name = "copilot_stage_seconds"
+    lines = [f"# HELP {name} Wall time per analysis pipeline stage", f"# TYPE {name} histogram"]
+    with _pipelines_lock:
+        pipelines = list(_pipelines.items())
+    for pipeline, timings in pipelines:
+        with timings._lock:
+            stages = [(stage, list(timings.histograms[stage]), stat[1], stat[0]) for stage, stat in timings.stats.items()]
+        for stage, counts, total, count in stages:
+            base = (("pipeline", pipeline), ("stage", stage))
+            cumulative = 0
+            for bound, n in zip(timings.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{format_labels((), (), base + (('le', format_value(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels((), (), base)} {format_value(total)}")
+            lines.append(f"{name}_count{format_labels((), (), base)} {count}")
+    return lines
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Offline replay of the server.py detectors over recorded files.
+
+Runs the same MotionAnalyzer / FrameSampler / MotionAlertState and speech
+VAD the live server uses, with no LiveKit connection, and reports
+throughput, per-stage timings and the alerts that would have fired. Media
+time stands in for the event loop clock, so sampling and cooldowns behave as
+they would on a live stream.
+
+    python replay.py --video bodycam.mp4 --audio bodycam.mp3
+    python replay.py --video bodycam.mp4 --every-frame --min-motion-area 0.01
+"""
+import argparse
+import time
+
+import numpy as np
+import cv2
+from livekit import rtc
+from dotenv import load_dotenv
+
+from motion import FrameSampler, MotionAlertState, MotionAnalyzer, MotionConfig, load_roi_mask
+from profiling import StageTimings
+from voice_activity import SpeechAlertState, VoiceActivityDetector
+
+AUDIO_SAMPLE_RATE = 48000  # What rtc.AudioStream delivers by default
+AUDIO_FRAME_MS = 10
+
+
+def replay_video(path, config, identity, every_frame=False):
+    """Run motion detection over a video file; returns (alerts, stats)"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    timings = StageTimings()
+    analyzer = MotionAnalyzer(config, load_roi_mask(identity, config.roi_dir), timings=timings)
+    sampler = FrameSampler.from_env()
+    alert_state = MotionAlertState()
+    alerts = []
+    decoded = analyzed = 0
+    decode_time = analysis_time = 0.0
+
+    while True:
+        started = time.perf_counter()
+        ok, bgr = capture.read()
+        if not ok:
+            break
+        media_time = decoded / fps
+        decoded += 1
+        if not every_frame and not sampler.should_sample(media_time):
+            decode_time += time.perf_counter() - started
+            continue
+        # Hand the analyzer an I420 VideoFrame, exactly what the server requests from rtc.VideoStream
+        height, width = bgr.shape[:2]
+        i420 = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+        frame = rtc.VideoFrame(width, height, rtc.VideoBufferType.I420, i420.tobytes())
+        decode_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = analyzer.analyze(frame)
+        elapsed = time.perf_counter() - started
+        analysis_time += elapsed
+        analyzed += 1
+        if result is None:
+            continue
+        sampler.record(result.has_motion, elapsed, media_time)
+        if alert_state.update(result.has_motion, media_time):
+            alerts.append((media_time, "motion", f"Motion detected from {identity} - Area: {result.motion_fraction:.1%} of frame"))
+
+    capture.release()
+    return alerts, {
+        "decoded": decoded,
+        "analyzed": analyzed,
+        "media_seconds": decoded / fps,
+        "decode_time": decode_time,
+        "analysis_time": analysis_time,
+        "timings": timings,
+    }
+
+
+def replay_audio(path, identity):
+    """Run speech detection over an audio (or video) file; returns (alerts, stats)"""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(path).set_channels(1).set_frame_rate(AUDIO_SAMPLE_RATE).set_sample_width(2)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.int16)
+    frame_size = AUDIO_SAMPLE_RATE * AUDIO_FRAME_MS // 1000
+    total_frames = len(samples) // frame_size
+
+    timings = StageTimings()
+    vad = VoiceActivityDetector(AUDIO_SAMPLE_RATE, timings=timings)
+    alert_state = SpeechAlertState()
+    alerts = []
+    speech_windows = 0
+    started = time.perf_counter()
+    for i in range(total_frames):
+        media_time = i * AUDIO_FRAME_MS / 1000
+        result = vad.process(samples[i * frame_size:(i + 1) * frame_size])
+        speech_windows += result.windows if vad.active else 0
+        if result.windows and alert_state.update(result.speech, media_time):
+            alerts.append((media_time, "speech", f"Speech detected from {identity} - Volume: {result.level:.1f}"))
+    return alerts, {
+        "frames": total_frames,
+        "speech_seconds": speech_windows * vad.config.window_ms / 1000,
+        "media_seconds": total_frames * AUDIO_FRAME_MS / 1000,
+        "analysis_time": time.perf_counter() - started,
+        "timings": timings,
+    }
+
+
+def main():
+    load_dotenv('.env')
+    parser = argparse.ArgumentParser(description="Replay recorded media through the camera-stream-int detectors")
+    parser.add_argument("--video", help="Video file to run motion detection on")
+    parser.add_argument("--audio", help="Audio file to run speech detection on")
+    parser.add_argument("--identity", default="replay", help="Participant identity (selects the ROI mask)")
+    parser.add_argument("--every-frame", action="store_true", help="Analyze every frame instead of using the sampling schedule")
+    parser.add_argument("--analysis-size", help="Working resolution, e.g. 160x120")
+    parser.add_argument("--background-model", help="running_average, frame_diff, mog2 or knn")
+    parser.add_argument("--min-cell-motion", type=float, help="Fraction of a grid cell that must change")
+    parser.add_argument("--min-motion-area", type=float, help="Fraction of the frame that must be in motion")
+    args = parser.parse_args()
+
+    if not args.video and not args.audio:
+        parser.error("at least one of --video / --audio is required")
+
+    config = MotionConfig.from_env()
+    if args.analysis_size:
+        config.analysis_width, config.analysis_height = (int(v) for v in args.analysis_size.lower().split("x"))
+    if args.background_model:
+        config.background_model = args.background_model
+    if args.min_cell_motion is not None:
+        config.min_cell_motion = args.min_cell_motion
+    if args.min_motion_area is not None:
+        config.min_motion_area = args.min_motion_area
+
+    alerts = []
+    if args.video:
+        print(f"🎥 Replaying video: {args.video}")
+        video_alerts, stats = replay_video(args.video, config, args.identity, args.every_frame)
+        alerts += video_alerts
+        analysis_time = stats["analysis_time"]
+        print(f"📹 {stats['decoded']} frames decoded, {stats['analyzed']} analyzed over {stats['media_seconds']:.1f}s of media")
+        print(f"⏱️  Decode: {stats['decode_time']:.2f}s, analysis: {analysis_time:.2f}s "
+              f"({stats['analyzed'] / analysis_time if analysis_time else 0:.1f} analyzed frames/sec)")
+        for line in stats["timings"].summary():
+            print(f"   {line}")
+
+    if args.audio:
+        print(f"🎵 Replaying audio: {args.audio}")
+        audio_alerts, stats = replay_audio(args.audio, args.identity)
+        alerts += audio_alerts
+        print(f"🎵 {stats['frames']} audio frames over {stats['media_seconds']:.1f}s of media, "
+              f"{stats['speech_seconds']:.1f}s of speech, analyzed in {stats['analysis_time']:.3f}s")
+        for line in stats["timings"].summary():
+            print(f"   {line}")
+
+    print(f"🚨 {len(alerts)} alerts would have fired:")
+    for media_time, kind, text in sorted(alerts):
+        print(f"   {media_time:8.2f}s  {kind:<6}  {text}")
+
+
+if __name__ == "__main__":
+    main()
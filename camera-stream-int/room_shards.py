@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Multi-room sharded worker mode for server.py.
+
+    python room_shards.py --rooms patrol-1,patrol-2,patrol-3 --shards 2
+    python room_shards.py --pattern 'patrol-*' --shards 4
+
+The supervisor owns the room list and spreads rooms over a pool of shard
+processes. With --pattern it polls the LiveKit room service and picks up
+rooms as they appear (and drops them when they close). Each shard runs every
+room assigned to it as server.main(room) on its own event loop thread, so
+stopping a room cancels everything that room started.
+
+Shards report per-room load every SHARD_REPORT_INTERVAL_S. A room's load is
+its subscribed tracks, audio weighted by SHARD_AUDIO_TRACK_WEIGHT since the
+VAD is far cheaper than motion analysis. The supervisor prints per-shard
+work and, when the busiest and idlest shard differ by more than
+SHARD_REBALANCE_MIN, moves the room that best closes the gap. A moved room
+is not moved again for SHARD_MOVE_COOLDOWN_S.
+
+A room whose server.main fails (connect or token errors, a crash) is
+restarted by its shard after SHARD_RESTART_BACKOFF_S, doubling on each
+consecutive failure up to SHARD_RESTART_BACKOFF_MAX_S; a room that stayed
+up longer than the maximum starts over from the base delay. Rooms waiting
+for a restart show up as down in the supervisor's summary.
+
+Each shard serves its own /metrics: shard i listens on METRICS_PORT + i
+(METRICS_PORT=0 keeps the endpoints off), so scrape every shard's port.
+"""
+import argparse
+import asyncio
+import fnmatch
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+
+
+def _run_room(name, load):
+    """Room thread: run server.main for one room until it is cancelled"""
+    import server
+
+    holder = {}
+    started = threading.Event()
+
+    async def runner():
+        holder["loop"] = asyncio.get_running_loop()
+        holder["task"] = asyncio.current_task()
+        started.set()
+        await server.main(name, load)
+
+    def run():
+        try:
+            asyncio.run(runner())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"❌ Room {name} stopped: {e}")
+        finally:
+            started.set()
+
+    thread = threading.Thread(target=run, name=f"room-{name}", daemon=True)
+    thread.start()
+    started.wait()  # So a stop right after the start can always find the room's loop
+    return thread, holder
+
+
+def _stop_room(thread, holder):
+    """Cancel a room's main task if its thread is still running"""
+    if "loop" in holder and thread.is_alive():
+        try:
+            holder["loop"].call_soon_threadsafe(holder["task"].cancel)
+        except RuntimeError:
+            pass  # The room died and closed its loop just now
+
+
+@dataclass
+class _ShardRoom:
+    name: str
+    load: object  # server.RoomLoad
+    thread: threading.Thread = None
+    holder: dict = field(default_factory=dict)
+    started_at: float = 0.0
+    analyzed: int = 0  # load.analyzed at the last report
+    failures: int = 0  # Consecutive failures
+    restarts: int = 0
+    restart_at: float = None  # Monotonic time of the pending restart, if the room is down
+
+    def start(self):
+        self.thread, self.holder = _run_room(self.name, self.load)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+
+def _run_shard(index, commands, reports, report_interval, audio_weight, metrics_port, restart_backoff):
+    """Shard process: start and stop rooms on command, restart rooms that die and report their load"""
+    # server.main reads METRICS_PORT; each shard gets its own so they do not fight over one port
+    os.environ["METRICS_PORT"] = str(metrics_port)
+    import server
+
+    load_dotenv('.env')
+    backoff, backoff_max = restart_backoff
+    rooms = {}  # name -> _ShardRoom
+    next_report = time.monotonic() + report_interval
+    while True:
+        wake = min([next_report] + [room.restart_at for room in rooms.values() if room.restart_at is not None])
+        try:
+            msg = commands.get(timeout=max(0.0, wake - time.monotonic()))
+        except queue.Empty:
+            msg = ()
+        if msg is None:
+            break
+        if msg and msg[0] == "start" and msg[1] not in rooms:
+            room = rooms[msg[1]] = _ShardRoom(msg[1], server.RoomLoad())
+            room.start()
+        elif msg and msg[0] == "stop" and msg[1] in rooms:
+            room = rooms.pop(msg[1])
+            if room.thread is not None:
+                _stop_room(room.thread, room.holder)
+                room.thread.join(timeout=10)
+
+        now = time.monotonic()
+        for room in rooms.values():
+            if room.thread.is_alive():
+                continue
+            if room.restart_at is None:
+                # A room only ends on its own when server.main failed
+                room.failures = 1 if now - room.started_at > backoff_max else room.failures + 1
+                delay = min(backoff_max, backoff * 2 ** (room.failures - 1))
+                room.restart_at = now + delay
+                print(f"🔁 Room {room.name} is down, restarting in {delay:.0f}s (failure {room.failures})")
+            elif now >= room.restart_at:
+                room.load = server.RoomLoad()
+                room.analyzed = 0
+                room.restarts += 1
+                room.start()
+
+        if now >= next_report:
+            report = {}
+            for name, room in rooms.items():
+                load = room.load
+                rate = (load.analyzed - room.analyzed) / report_interval
+                room.analyzed = load.analyzed
+                score = load.video_tracks + audio_weight * load.audio_tracks
+                report[name] = {"score": score, "video": load.video_tracks, "audio": load.audio_tracks,
+                                "analyzed_per_s": rate, "alive": room.thread.is_alive(), "restarts": room.restarts}
+            reports.put((index, report))
+            next_report = time.monotonic() + report_interval
+
+    for room in rooms.values():
+        _stop_room(room.thread, room.holder)
+    for room in rooms.values():
+        room.thread.join(timeout=10)
+
+
+class RoomShardSupervisor:
+    """Assigns rooms to shard processes and keeps their load balanced"""
+
+    def __init__(self, num_shards, rooms=(), pattern=None, report_interval=None, rebalance_min=None,
+                 move_cooldown=None, audio_weight=None):
+        self.num_shards = num_shards
+        self.static_rooms = list(rooms)
+        self.pattern = pattern
+        self.report_interval = report_interval or float(os.getenv("SHARD_REPORT_INTERVAL_S", "10"))
+        self.rebalance_min = rebalance_min if rebalance_min is not None else float(os.getenv("SHARD_REBALANCE_MIN", "2"))
+        self.move_cooldown = move_cooldown if move_cooldown is not None else float(os.getenv("SHARD_MOVE_COOLDOWN_S", "60"))
+        self.audio_weight = audio_weight if audio_weight is not None else float(os.getenv("SHARD_AUDIO_TRACK_WEIGHT", "0.2"))
+        self.metrics_port = int(os.getenv("METRICS_PORT", "9102"))
+        self.restart_backoff = (float(os.getenv("SHARD_RESTART_BACKOFF_S", "5")),
+                                float(os.getenv("SHARD_RESTART_BACKOFF_MAX_S", "300")))
+        self.context = mp.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.commands = []
+        self.processes = []
+        self.assignment = {}  # room -> shard index
+        self.room_load = {}  # room -> latest report entry
+        self.moved_at = {}  # room -> monotonic time of its last move
+
+    def start(self):
+        for i in range(self.num_shards):
+            commands = self.context.Queue()
+            metrics_port = self.metrics_port + i if self.metrics_port else 0
+            # Not daemonic: a room may start its own analyzer fleet (ANALYZER_PROCESSES)
+            process = self.context.Process(
+                target=_run_shard,
+                args=(i, commands, self.reports, self.report_interval, self.audio_weight, metrics_port,
+                      self.restart_backoff),
+                name=f"room-shard-{i}",
+            )
+            process.start()
+            self.commands.append(commands)
+            self.processes.append(process)
+        print(f"🧩 Started {self.num_shards} room shards")
+        if self.metrics_port:
+            print(f"📈 Shard metrics on ports {self.metrics_port}-{self.metrics_port + self.num_shards - 1}")
+
+    def shard_loads(self):
+        loads = [0.0] * self.num_shards
+        for room, shard in self.assignment.items():
+            loads[shard] += self.room_load.get(room, {}).get("score", 0.0)
+        return loads
+
+    def add_room(self, room):
+        loads = self.shard_loads()
+        counts = [0] * self.num_shards
+        for shard in self.assignment.values():
+            counts[shard] += 1
+        shard = min(range(self.num_shards), key=lambda i: (loads[i], counts[i]))
+        self.assignment[room] = shard
+        self.commands[shard].put(("start", room))
+        print(f"🧩 Room {room} -> shard {shard}")
+
+    def remove_room(self, room):
+        shard = self.assignment.pop(room)
+        self.room_load.pop(room, None)
+        self.commands[shard].put(("stop", room))
+        print(f"🧩 Room {room} removed from shard {shard}")
+
+    def rebalance(self):
+        """Move at most one room from the busiest to the idlest shard; returns the moved room or None"""
+        loads = self.shard_loads()
+        busiest = max(range(self.num_shards), key=loads.__getitem__)
+        idlest = min(range(self.num_shards), key=loads.__getitem__)
+        gap = loads[busiest] - loads[idlest]
+        if gap <= self.rebalance_min:
+            return None
+        now = time.monotonic()
+        best, best_gap = None, gap
+        for room, shard in self.assignment.items():
+            if shard != busiest or now - self.moved_at.get(room, float("-inf")) < self.move_cooldown:
+                continue
+            score = self.room_load.get(room, {}).get("score", 0.0)
+            new_gap = abs(gap - 2 * score)
+            if score > 0 and new_gap < best_gap:
+                best, best_gap = room, new_gap
+        if best is None or gap - best_gap <= self.rebalance_min:
+            return None
+        self.commands[busiest].put(("stop", best))
+        self.commands[idlest].put(("start", best))
+        self.assignment[best] = idlest
+        self.moved_at[best] = now
+        print(f"⚖️ Moved room {best} from shard {busiest} to shard {idlest} (load gap {gap:.1f} -> {best_gap:.1f})")
+        return best
+
+    async def discover_rooms(self, lkapi):
+        """Current room names matching the pattern"""
+        from livekit import api
+
+        response = await lkapi.room.list_rooms(api.ListRoomsRequest())
+        return {room.name for room in response.rooms if fnmatch.fnmatchcase(room.name, self.pattern)}
+
+    def summary(self):
+        loads = self.shard_loads()
+        lines = []
+        for shard in range(self.num_shards):
+            rooms = [room for room, s in self.assignment.items() if s == shard]
+            video = sum(self.room_load.get(room, {}).get("video", 0) for room in rooms)
+            audio = sum(self.room_load.get(room, {}).get("audio", 0) for room in rooms)
+            rate = sum(self.room_load.get(room, {}).get("analyzed_per_s", 0.0) for room in rooms)
+            down = [f"{room} (restarts={self.room_load[room].get('restarts', 0)})" for room in rooms
+                    if not self.room_load.get(room, {}).get("alive", True)]
+            lines.append(f"shard {shard}: load={loads[shard]:.1f} rooms={len(rooms)} video={video} audio={audio} "
+                         f"analyzed={rate:.1f}/s" + (f" down: {', '.join(down)}" if down else ""))
+        return lines
+
+    async def run(self):
+        self.start()
+        for room in self.static_rooms:
+            self.add_room(room)
+        lkapi = None
+        if self.pattern:
+            from livekit import api
+            lkapi = api.LiveKitAPI(os.getenv("LIVEKIT_URL"), os.getenv("LIVEKIT_API_KEY"), os.getenv("LIVEKIT_API_SECRET"))
+        try:
+            while True:
+                if lkapi is not None:
+                    try:
+                        found = await self.discover_rooms(lkapi)
+                        for room in sorted(found - set(self.assignment)):
+                            self.add_room(room)
+                        for room in sorted(set(self.assignment) - found - set(self.static_rooms)):
+                            self.remove_room(room)
+                    except Exception as e:
+                        print(f"❌ Room discovery failed: {e}")
+
+                await asyncio.sleep(self.report_interval)
+                while True:
+                    try:
+                        shard, report = self.reports.get_nowait()
+                    except queue.Empty:
+                        break
+                    for room, entry in report.items():
+                        if self.assignment.get(room) == shard:
+                            self.room_load[room] = entry
+                for line in self.summary():
+                    print(f"📊 {line}")
+                self.rebalance()
+        finally:
+            if lkapi is not None:
+                await lkapi.aclose()
+            self.close()
+
+    def close(self):
+        for commands in self.commands:
+            commands.put(None)
+        for process in self.processes:
+            process.join(timeout=15)
+
+
+def main():
+    load_dotenv('.env')
+    parser = argparse.ArgumentParser(description="Run server.py analysis over many rooms, sharded across processes")
+    parser.add_argument("--rooms", help="Comma separated room names")
+    parser.add_argument("--pattern", help="Room name glob, e.g. 'patrol-*' (rooms are discovered through the room service)")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("ROOM_SHARDS", os.cpu_count() or 1)),
+                        help="Number of shard processes")
+    args = parser.parse_args()
+
+    rooms = [room.strip() for room in (args.rooms or "").split(",") if room.strip()]
+    if not rooms and not args.pattern:
+        parser.error("at least one of --rooms / --pattern is required")
+
+    supervisor = RoomShardSupervisor(max(1, args.shards), rooms, args.pattern)
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
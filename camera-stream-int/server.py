@@ -1,232 +1,409 @@
 #!/usr/bin/env python3
+import time
+START_TIME = time.perf_counter()  # Time-to-ready is measured from here, before the heavy imports
 import asyncio
-import numpy as np
-import cv2
-import os
 import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from livekit import rtc
-from livekit.api import AccessToken, VideoGrants
-from moviepy import VideoFileClip
-from pydub import AudioSegment
 from dotenv import load_dotenv
+from tokens import get_token
+from alerts import Alert, AlertAssetRegistry, AlertDispatcher
+from alert_cache import CLIP_REQUEST_TOPIC
+from playback import PcmPlayer
+from metrics import ANALYSIS_SECONDS, AUDIO_LEVEL, FRAMES_ANALYZED, FRAMES_DROPPED, FRAMES_RECEIVED, start_metrics_server
+from audio_decode import PLAYBACK_SAMPLE_RATE, PcmCache, prefetch
+from profiling import dump_pipelines, pipeline_timings
+from loop_watchdog import LoopWatchdog
+from track_registry import TrackRegistry
+from subscription import SubscriptionRules
 
 # Load environment variables
 load_dotenv('.env')
 
-def generate_token(identity="server", name="Server", room="copilot-room"):
-    """Generate a LiveKit access token"""
-    api_key = os.getenv('LIVEKIT_API_KEY')
-    api_secret = os.getenv('LIVEKIT_API_SECRET')
-    
-    if not api_key or not api_secret:
-        raise ValueError("LIVEKIT_API_KEY and LIVEKIT_API_SECRET must be set in .env file")
-    
-    token = AccessToken(api_key, api_secret) \
-        .with_identity(identity) \
-        .with_name(name) \
-        .with_grants(VideoGrants(
-            room_join=True,
-            room=room,
-        ))
-    return token.to_jwt()
+def import_detectors():
+    """Import the OpenCV / NumPy detector modules (run off the event loop while the room connects)"""
+    import motion
+    import voice_activity
+    import motion_batch
+    import analyzer_fleet
+    return motion, voice_activity, motion_batch, analyzer_fleet
 
-async def send_mp3_alert(room, mp3_filename, alert_text):
-    """Send MP3 audio file as data packet to LiveKit room"""
-    try:
-        if os.path.exists(mp3_filename):
-            print(f"🎵 Sending MP3 alert: {mp3_filename}")
-            with open(mp3_filename, 'rb') as f:
-                mp3_data = f.read()
-            
-            # Send MP3 data with topic "audio_alert"
-            await room.local_participant.publish_data(
-                payload=mp3_data, topic="audio_alert", reliable=True
-            )
-            print(f"✅ MP3 alert sent: {mp3_filename} ({len(mp3_data)} bytes)")
-        else:
-            print(f"❌ MP3 file not found: {mp3_filename}, falling back to text")
-            # Fallback to text alert
-            await room.local_participant.publish_data(
-                payload=alert_text.encode(), topic="alert", reliable=True
-            )
-    except Exception as e:
-        print(f"❌ Error sending MP3 alert: {e}")
-        # Fallback to text alert
-        await room.local_participant.publish_data(
-            payload=alert_text.encode(), topic="alert", reliable=True
-        )
+@dataclass
+class RoomLoad:
+    """Work one room puts on this process; room_shards.py balances rooms on it"""
+    video_tracks: int = 0
+    audio_tracks: int = 0
+    analyzed: int = 0  # Detector results handled so far
+
+class LatestFrameSlot:
+    """Single-slot handoff between a track's receive loop and its analysis loop.
+
+    put() overwrites any frame still waiting, so when analysis falls behind it
+    skips stale frames instead of building up latency.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    def take(self):
+        """Return the waiting frame (or None) without blocking"""
+        frame, self._frame = self._frame, None
+        return frame
 
-async def play_audio_file(audio_data, audio_source, sample_rate, channels=1):
-    """Play audio file (MP3/MP4) through LiveKit audio source"""
+    async def get(self):
+        """Wait for the newest frame; returns None once the slot is closed and drained"""
+        while self._frame is None and not self._closed:
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+async def play_audio_file(blocks, audio_source):
+    """Play PCM blocks from an audio file (MP3/MP4) through LiveKit audio source"""
     try:
         print("🎵 Starting audio file playback...")
         
-        # Calculate frame size (1024 samples per frame)
-        frame_size = 1024
-        total_frames = len(audio_data) // frame_size
-        
-        for i in range(total_frames):
-            start_idx = i * frame_size
-            end_idx = start_idx + frame_size
-            frame_data = audio_data[start_idx:end_idx]
-            
-            # Create audio frame
-            audio_frame = rtc.AudioFrame(
-                data=frame_data.tobytes(),
-                sample_rate=sample_rate,
-                num_channels=channels,
-                samples_per_channel=frame_size
-            )
-            
-            # Send frame to LiveKit
-            await audio_source.capture_frame(audio_frame)
-            
-            # Wait for next frame (maintain real-time playback)
-            await asyncio.sleep(frame_size / sample_rate)
+        # 10 ms frames on a monotonic schedule; the player paces against the source's queue
+        stats = await PcmPlayer(audio_source, name="audio_file").play(blocks)
         
-        print("✅ Audio file playback completed")
+        print(f"✅ Audio file playback completed: {stats.summary()}")
         
     except Exception as e:
         print(f"❌ Error playing audio file: {e}")
 
-async def main():
+async def main(room_name=None, load=None):
+    room_name = room_name or os.getenv("LIVEKIT_ROOM", "copilot-room")
+    load = load if load is not None else RoomLoad()
     room = rtc.Room()
+    loop = asyncio.get_running_loop()
     
-    # Audio source for MP4 playback
-    audio_source = None
-    audio_track = None
+    # Startup steps run concurrently; tracks subscribed before the detectors are loaded wait for `ready`
+    ready = asyncio.Event()
+    startup_times = {}
+    
+    async def timed(name, awaitable):
+        started = time.perf_counter()
+        result = await awaitable
+        startup_times[name] = time.perf_counter() - started
+        return result
+    
+    # Loop lag sampling plus logging of whichever task step or callback blocks the loop
+    watchdog = LoopWatchdog(room_name)
+    asyncio.create_task(watchdog.run(), name="loop watchdog")
+    asyncio.create_task(watchdog.report(float(os.getenv("LOOP_LAG_REPORT_INTERVAL_S", "30"))), name="loop lag report")
+    
+    # Bounded pool for OpenCV work (it releases the GIL), shared by all tracks
+    analysis_threads = int(os.getenv("ANALYSIS_THREADS", min(4, os.cpu_count() or 1)))
+    executor = ThreadPoolExecutor(max_workers=analysis_threads, thread_name_prefix="motion")
+    motion = voice_activity = motion_config = None  # Set once import_detectors() finishes
+    
+    # Alert clips live in memory (loaded during startup); the watcher picks up edited files
+    alert_assets = AlertAssetRegistry()
+    
+    # Detection loops only queue alerts; one task does the sending
+    dispatcher = AlertDispatcher.from_env(room, alert_assets)
+    asyncio.create_task(dispatcher.run(), name="alert dispatcher")
+    asyncio.create_task(dispatcher.report(float(os.getenv("ALERT_REPORT_INTERVAL_S", "30"))), name="alert report")
+    
+    # ANALYZER_PROCESSES > 0 moves detection into worker processes fed through shared memory
+    analyzer_processes = int(os.getenv("ANALYZER_PROCESSES", "0"))
+    fleet = None
+    fleet_tracks = {}  # track sid -> participant identity, alert state, metric labels
+    fleet_samplers = {}  # track sid -> FrameSampler (video only)
+    
+    # MOTION_BATCH_INTERVAL_MS > 0 analyzes the latest frame of every track together on a fixed tick
+    batch_interval = int(os.getenv("MOTION_BATCH_INTERVAL_MS", "0")) / 1000
+    batcher = None
+    batch_tracks = {}  # track sid -> participant identity, frame slot, alert state, sampler, metric labels
+    
+    # Every track's tasks, keyed by SID; unsubscribes and departures cancel them and free their buffers
+    tracks = TrackRegistry(room_name)
+    
+    # Only tracks passing the subscription rules are subscribed (and so decoded) at all
+    subscription_rules = SubscriptionRules.from_env()
+    asyncio.create_task(tracks.report(float(os.getenv("TRACK_REPORT_INTERVAL_S", "60"))), name="track report")
     
     # Audio source for MP4 playback
     audio_source = None
     audio_track = None
+    
+    # Prometheus text at /metrics; one endpoint per process, shared by every room it runs
+    start_metrics_server(int(os.getenv("METRICS_PORT", "9102")))
+    
+    # PROFILE_STAGES=1 times every analysis stage (shared per process, exported at /metrics); SIGUSR1 prints them
+    video_timings = pipeline_timings("video")
+    audio_timings = pipeline_timings("audio")
+    if video_timings is not None:
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, dump_pipelines)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            pass  # No SIGUSR1 on Windows, and only the main thread's loop gets signals (not sharded rooms)
+    
+    def track_labels(track, participant):
+        kind = "video" if track.kind == rtc.TrackKind.KIND_VIDEO else "audio"
+        return {"room": room_name, "participant": participant.identity, "track": track.sid, "kind": kind}
 
+    def handle_motion_result(identity, alert_state, result, analyzed_count):
+        """Feed one motion result into the track's alert state and queue the alert if it fires"""
+        should_alert = alert_state.update(result.has_motion, loop.time())
+        load.analyzed += 1
+        
+        # Debug motion detection
+        if analyzed_count % 10 == 0:  # Print every 10th analyzed frame
+            print(f"🔍 Motion check: regions={result.regions}, area={result.motion_fraction:.2%}, has_motion={result.has_motion}, history={list(alert_state.history)}")
+        
+        if should_alert:
+            alert = f"Motion detected from {identity} - Area: {result.motion_fraction:.1%} of frame"
+            
+            # Compact per-cell motion map: rows, cols, then one byte per cell
+            extra = []
+            if result.heatmap is not None:
+                rows, cols = result.heatmap.shape
+                extra.append(("motion_heatmap", bytes([rows, cols]) + motion.heatmap_bytes(result.heatmap)))
+            
+            # MP3 audio alert instead of text, sent by the dispatcher task
+            if dispatcher.submit(Alert("motion", identity, "motion_alert.mp3", alert, extra)):
+                print(f"📤 Motion alert: {alert}")
+    
+    def handle_vad_result(identity, alert_state, result):
+        """Feed one VAD result into the track's alert state and queue the alert if it fires"""
+        load.analyzed += 1
+        AUDIO_LEVEL.observe(result.level, room=room_name, participant=identity)
+        if alert_state.update(result.speech, loop.time()):
+            alert = f"Speech detected from {identity} - Volume: {result.level:.1f}"
+            
+            # MP3 audio alert instead of text, sent by the dispatcher task
+            if dispatcher.submit(Alert("speech", identity, "speech_alert.mp3", alert)):
+                print(f"📤 Speech alert: {alert}")
+    
+    async def handle_fleet_results():
+        """Drive alerts from the results the analyzer processes send back"""
+        analyzed_counts = {}
+        async for track_id, kind, value, seconds in fleet.results():
+            if track_id not in fleet_tracks:
+                continue
+            identity, state, labels = fleet_tracks[track_id]
+            try:
+                if kind == "dropped":
+                    FRAMES_DROPPED.inc(value, reason="overrun", **labels)
+                    continue
+                FRAMES_ANALYZED.inc(**labels)
+                if kind == "motion":
+                    analyzed_counts[track_id] = analyzed_counts.get(track_id, 0) + 1
+                    ANALYSIS_SECONDS.observe(seconds, room=room_name, mode="process")
+                    fleet_samplers[track_id].record(value.has_motion, seconds, loop.time())
+                    handle_motion_result(identity, state, value, analyzed_counts[track_id])
+                elif kind == "vad":
+                    handle_vad_result(identity, state, value)
+            except Exception as e:
+                print(f"Analyzer result error: {e}")
+    
+    async def run_motion_batches():
+        """Every tick, analyze the newest frame of all video tracks in one vectorized pass"""
+        analyzed_count = 0
+        next_tick = loop.time()
+        while True:
+            next_tick += batch_interval
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            frames = {}
+            for sid, (_, slot, _, _, _) in list(batch_tracks.items()):
+                frame = slot.take()
+                if frame is not None:
+                    frames[sid] = frame
+            if not frames:
+                continue
+            try:
+                started = loop.time()
+                results = await loop.run_in_executor(executor, batcher.analyze, frames)
+                elapsed = loop.time() - started
+                analyzed_count += 1
+                ANALYSIS_SECONDS.observe(elapsed / len(frames), room=room_name, mode="batch")
+                for sid, result in results.items():
+                    if sid in batch_tracks:
+                        FRAMES_ANALYZED.inc(**batch_tracks[sid][4])
+                    if result is not None and sid in batch_tracks:
+                        identity, _, alert_state, sampler, _ = batch_tracks[sid]
+                        sampler.record(result.has_motion, elapsed, loop.time())
+                        if video_timings is not None:
+                            video_timings.start()
+                        handle_motion_result(identity, alert_state, result, analyzed_count)
+                        if video_timings is not None:
+                            video_timings.lap("alert")
+            except Exception as e:
+                print(f"Motion batch error: {e}")
+    
+    async def forward_track(track, participant):
+        """Fleet mode: only receive frames and hand them to the analyzer processes"""
+        is_video = track.kind == rtc.TrackKind.KIND_VIDEO
+        labels = track_labels(track, participant)
+        if is_video:
+            stream = rtc.VideoStream(track, format=rtc.VideoBufferType.I420)
+            fleet_tracks[track.sid] = (participant.identity, motion.MotionAlertState(), labels)
+            fleet_samplers[track.sid] = motion.FrameSampler.from_env()
+            load.video_tracks += 1
+        else:
+            stream = rtc.AudioStream(track)
+            fleet_tracks[track.sid] = (participant.identity, voice_activity.SpeechAlertState(), labels)
+            load.audio_tracks += 1
+        if is_video:
+            fleet.open_track(track.sid, "video", motion.load_roi_mask(participant.identity, motion_config.roi_dir))
+        else:
+            fleet.open_track(track.sid, "audio")
+        frame_count = 0
+        
+        try:
+            async for frame_event in stream:
+                frame_count += 1
+                FRAMES_RECEIVED.inc(**labels)
+                if is_video and fleet_samplers[track.sid].should_sample(loop.time()):
+                    fleet.submit_video(track.sid, frame_event.frame)
+                elif is_video:
+                    FRAMES_DROPPED.inc(reason="sampled_out", **labels)
+                else:
+                    fleet.submit_audio(track.sid, frame_event.frame)
+        except Exception as e:
+            print(f"Track forwarding error: {e}")
+        finally:
+            fleet.close_track(track.sid)
+            fleet_tracks.pop(track.sid, None)
+            fleet_samplers.pop(track.sid, None)
+            if is_video:
+                load.video_tracks -= 1
+            else:
+                load.audio_tracks -= 1
+            await stream.aclose()
+    
+    @room.on("data_received")
+    def on_data_received(data: rtc.DataPacket):
+        # Clients that missed a referenced alert clip ask for it by hash
+        if data.topic == CLIP_REQUEST_TOPIC and data.participant is not None:
+            dispatcher.handle_clip_request(data.participant.identity, data.data)
+    
+    @room.on("track_published")
+    def on_track_published(publication: rtc.RemoteTrackPublication, participant: rtc.RemoteParticipant):
+        subscription_rules.apply(publication, participant)
+    
     @room.on("track_subscribed")
     def on_track_subscribed(track: rtc.Track, publication: rtc.TrackPublication, participant: rtc.RemoteParticipant):
         print(f"📥 Subscribed to track: {track.kind} from {participant.identity}")
+        tracks.open(track.sid, participant.identity, track_labels(track, participant)["kind"])
+        tracks.spawn(track.sid, start_track(track, participant), f"start {participant.identity} {track.sid}")
+    
+    @room.on("track_unsubscribed")
+    def on_track_unsubscribed(track: rtc.Track, publication: rtc.TrackPublication, participant: rtc.RemoteParticipant):
+        tracks.close_soon(track.sid, "unsubscribed")
+    
+    @room.on("participant_disconnected")
+    def on_participant_disconnected(participant: rtc.RemoteParticipant):
+        print(f"👋 Participant left: {participant.identity}")
+        tracks.close_participant_soon(participant.identity, "participant left")
+    
+    async def start_track(track, participant):
+        await ready.wait()
         
-        if track.kind == rtc.TrackKind.KIND_VIDEO:
+        if fleet is not None and track.kind in (rtc.TrackKind.KIND_VIDEO, rtc.TrackKind.KIND_AUDIO):
+            print(f"🏭 Forwarding {track.kind} from {participant.identity} to the analyzer fleet")
+            tracks.spawn(track.sid, forward_track(track, participant), f"forward {participant.identity} {track.sid}")
+            
+        elif track.kind == rtc.TrackKind.KIND_VIDEO:
             print(f"🎥 Starting video analysis for {participant.identity}")
+            labels = track_labels(track, participant)
+            
+            async def analyze_video_frames(slot, sampler):
+                analyzer = motion.MotionAnalyzer(motion_config, motion.load_roi_mask(participant.identity, motion_config.roi_dir),
+                                                 timings=video_timings)
+                alert_state = motion.MotionAlertState()
+                analyzed_count = 0
+                
+                while True:
+                    frame = await slot.get()
+                    if frame is None:
+                        break
+                    try:
+                        analyzed_count += 1
+                        if analyzed_count % 10 == 0:  # Print every 10th analyzed frame
+                            print(f"📹 Video frame {analyzed_count}: width={frame.width}, height={frame.height}, type={rtc.VideoBufferType.Name(frame.type)}, dropped={slot.dropped}")
+                        
+                        started = loop.time()
+                        result = await loop.run_in_executor(executor, analyzer.analyze, frame)
+                        elapsed = loop.time() - started
+                        ANALYSIS_SECONDS.observe(elapsed, room=room_name, mode="thread")
+                        FRAMES_ANALYZED.inc(**labels)
+                        if result is not None:
+                            sampler.record(result.has_motion, elapsed, loop.time())
+                            if video_timings is not None:
+                                video_timings.start()
+                            handle_motion_result(participant.identity, alert_state, result, analyzed_count)
+                            if video_timings is not None:
+                                video_timings.lap("alert")
+                    except Exception as e:
+                        print(f"Video frame error: {e}")
             
             async def process_video_track():
-                video_stream = rtc.VideoStream(track)
-                first_frame = None
-                frame_count = 0
-                last_alert_time = 0
-                motion_history = []  # Track motion over time
-                motion_threshold = 5  # Require 3 consecutive frames with motion
+                # Ask the FFI for I420 so the Y plane can be used as-is
+                video_stream = rtc.VideoStream(track, format=rtc.VideoBufferType.I420)
+                slot = LatestFrameSlot()
+                sampler = motion.FrameSampler.from_env()
+                if batcher is not None:
+                    batch_tracks[track.sid] = (participant.identity, slot, motion.MotionAlertState(), sampler, labels)
+                    batcher.add(track.sid, motion.load_roi_mask(participant.identity, motion_config.roi_dir))
+                    analysis_task = None
+                else:
+                    analysis_task = tracks.spawn(track.sid, analyze_video_frames(slot, sampler),
+                                                 f"analyze {participant.identity} {track.sid}")
+                load.video_tracks += 1
                 
                 try:
                     async for frame_event in video_stream:
-                        try:
-                            frame = frame_event.frame
-                            frame_count += 1
-                            
-                            if frame_count % 3 == 0:
-                                frame_data = np.frombuffer(frame.data, dtype=np.uint8)
-                                if frame_count % 30 == 0:  # Print every 10th frame (every 3 seconds at 10fps)
-                                    print(f"📹 Video frame {frame_count}: width={frame.width}, height={frame.height}, data_size={len(frame_data)}")
-                                if frame_count % 30 == 0:  # Print every 10th frame (every 3 seconds at 10fps)
-                                    print(f"📹 Video frame {frame_count}: width={frame.width}, height={frame.height}, data_size={len(frame_data)}")
-                                
-                                expected_pixels = frame.height * frame.width
-                                actual_pixels = len(frame_data)
-                                
-                                if actual_pixels == expected_pixels * 3:  # RGB
-                                    frame_image = frame_data.reshape((frame.height, frame.width, 3))
-                                    gray = cv2.cvtColor(frame_image, cv2.COLOR_RGB2GRAY)
-                                elif actual_pixels == expected_pixels * 4:  # RGBA
-                                    frame_image = frame_data.reshape((frame.height, frame.width, 4))
-                                    gray = cv2.cvtColor(frame_image, cv2.COLOR_RGBA2GRAY)
-                                elif actual_pixels == expected_pixels:  # Grayscale
-                                    gray = frame_data.reshape((frame.height, frame.width))
-                                elif actual_pixels == expected_pixels * 1.5:  # YUV420 or similar
-                                    # Take first expected_pixels bytes (Y channel)
-                                    gray_data = frame_data[:expected_pixels]
-                                    gray = gray_data.reshape((frame.height, frame.width))
-                                else:
-                                    # Fallback: take first expected_pixels bytes
-                                    if actual_pixels >= expected_pixels:
-                                        gray_data = frame_data[:expected_pixels]
-                                        gray = gray_data.reshape((frame.height, frame.width))
-                                    else:
-                                        continue
-                                
-                                gray = cv2.GaussianBlur(gray, (21, 21), 0)
-                                
-                                if first_frame is not None:
-                                    # Ensure both frames have the same shape
-                                    if first_frame.shape == gray.shape:
-                                        frame_delta = cv2.absdiff(first_frame, gray)
-                                        thresh = cv2.threshold(frame_delta, 25, 255, cv2.THRESH_BINARY)[1]
-                                        thresh = cv2.dilate(thresh, None, iterations=2)
-                                        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                                        
-                                        # Count significant contours
-                                        significant_contours = 0
-                                        total_motion_area = 0
-                                        for contour in contours:
-                                            area = cv2.contourArea(contour)
-                                            if area > 500:  # Increased threshold for significant motion
-                                                significant_contours += 1
-                                                total_motion_area += area
-                                        
-                                        # Add motion status to history
-                                        has_motion = significant_contours > 0 and total_motion_area > 2000
-                                        motion_history.append(has_motion)
-                                        
-                                        # Debug motion detection
-                                        if frame_count % 30 == 0:  # Print every 10th frame
-                                            print(f"🔍 Motion check: contours={significant_contours}, area={total_motion_area:.0f}, has_motion={has_motion}, history={motion_history}")
-                                        
-                                        # Debug motion detection
-                                        if frame_count % 30 == 0:  # Print every 10th frame
-                                            print(f"🔍 Motion check: contours={significant_contours}, area={total_motion_area:.0f}, has_motion={has_motion}, history={motion_history}")
-                                        
-                                        # Keep only last 5 frames
-                                        if len(motion_history) > 5:
-                                            motion_history.pop(0)
-                                        
-                                        # Check if we have enough motion history
-                                        if len(motion_history) >= motion_threshold:
-                                            # Require motion in at least 2 out of 3 recent frames
-                                            recent_motion = sum(motion_history[-motion_threshold:])
-                                            if recent_motion >= 2:
-                                                current_time = asyncio.get_event_loop().time()
-                                                if (current_time - last_alert_time) > 8:  # Increased cooldown
-                                                    last_alert_time = current_time
-                                                    alert = f"Motion detected from {participant.identity} - Area: {total_motion_area:.0f}px"
-                                                    
-                                                    # Send MP3 audio alert instead of text
-                                                    await send_mp3_alert(room, "motion_alert.mp3", alert)
-                                                    
-                                                    # Send MP3 audio alert instead of text
-                                                    await send_mp3_alert(room, "motion_alert.mp3", alert)
-                                                    print(f"📤 Motion alert: {alert}")
-                                                    # Clear motion history after alert
-                                                    motion_history.clear()
-                                    else:
-                                        # Reset first frame if shapes don't match
-                                        print(f"Frame shape mismatch: {first_frame.shape} vs {gray.shape}, resetting")
-                                        first_frame = gray.copy()
-                                        motion_history.clear()
-                                else:
-                                    first_frame = gray.copy()
-                        except Exception as e:
-                            print(f"Video frame error: {e}")
+                        FRAMES_RECEIVED.inc(**labels)
+                        if sampler.should_sample(loop.time()):
+                            dropped = slot.dropped
+                            slot.put(frame_event.frame)
+                            if slot.dropped != dropped:
+                                FRAMES_DROPPED.inc(reason="stale", **labels)
+                        else:
+                            FRAMES_DROPPED.inc(reason="sampled_out", **labels)
                 except Exception as e:
                     print(f"Video track error: {e}")
                 finally:
+                    slot.close()
+                    if analysis_task is not None:
+                        # Closing the track cancels the analysis task too; its cancellation is not ours to raise
+                        await asyncio.gather(analysis_task, return_exceptions=True)
+                    elif batch_tracks.get(track.sid, (None, None))[1] is slot:
+                        # A resubscribe under the same SID may already have registered its replacement
+                        del batch_tracks[track.sid]
+                        batcher.remove(track.sid)
+                    load.video_tracks -= 1
                     await video_stream.aclose()
             
-            asyncio.create_task(process_video_track())
+            tracks.spawn(track.sid, process_video_track(), f"video {participant.identity} {track.sid}")
             
         elif track.kind == rtc.TrackKind.KIND_AUDIO:
             print(f"🎵 Starting audio analysis for {participant.identity}")
+            labels = track_labels(track, participant)
             
             async def process_audio_track():
                 audio_stream = rtc.AudioStream(track)
                 frame_count = 0
-                last_alert_time = 0
+                vad = None
+                alert_state = voice_activity.SpeechAlertState()
+                load.audio_tracks += 1
                 
                 try:
                     async for frame_event in audio_stream:
@@ -234,34 +411,31 @@ async def main():
                             frame = frame_event.frame
                             frame_count += 1
                             
-                            if frame_count % 10 == 0:
-                                audio_data = np.frombuffer(frame.data, dtype=np.int16)
-                                volume = np.sqrt(np.mean(audio_data.astype(float) ** 2))
-                                if frame_count % 100 == 0:  # Print every 10th audio frame
-                                    print(f"🎵 Audio frame {frame_count}: volume={volume:.1f}")
-                                if frame_count % 100 == 0:  # Print every 10th audio frame
-                                    print(f"🎵 Audio frame {frame_count}: volume={volume:.1f}")
-                                
-                                if volume > 800:  # Lowered threshold
-                                    current_time = asyncio.get_event_loop().time()
-                                    if (current_time - last_alert_time) > 3:
-                                        last_alert_time = current_time
-                                        alert = f"Speech detected from {participant.identity} - Volume: {volume:.1f}"
-                                        
-                                        # Send MP3 audio alert instead of text
-                                        await send_mp3_alert(room, "speech_alert.mp3", alert)
-                                        
-                                        # Send MP3 audio alert instead of text
-                                        await send_mp3_alert(room, "speech_alert.mp3", alert)
-                                        print(f"📤 Speech alert: {alert}")
+                            if vad is None or vad.sample_rate != frame.sample_rate:
+                                vad = voice_activity.VoiceActivityDetector(frame.sample_rate, timings=audio_timings)
+                            
+                            # Every sample goes through the VAD, not just every 10th frame
+                            result = vad.process(voice_activity.frame_samples(frame))
+                            FRAMES_RECEIVED.inc(**labels)
+                            FRAMES_ANALYZED.inc(**labels)
+                            if frame_count % 100 == 0:  # Print every 100th audio frame
+                                print(f"🎵 Audio frame {frame_count}: volume={result.level:.1f}, speech={vad.active}")
+                            
+                            if result.windows:
+                                if audio_timings is not None:
+                                    audio_timings.start()
+                                handle_vad_result(participant.identity, alert_state, result)
+                                if audio_timings is not None:
+                                    audio_timings.lap("alert")
                         except Exception as e:
                             print(f"Audio frame error: {e}")
                 except Exception as e:
                     print(f"Audio track error: {e}")
                 finally:
+                    load.audio_tracks -= 1
                     await audio_stream.aclose()
             
-            asyncio.create_task(process_audio_track())
+            tracks.spawn(track.sid, process_audio_track(), f"audio {participant.identity} {track.sid}")
         
         print(f"✅ Track {track.kind} ready for processing")
 
@@ -269,72 +443,97 @@ async def main():
     if not url:
         raise ValueError("LIVEKIT_URL must be set in .env file")
     
-    token = generate_token(identity="server", name="Server", room="copilot-room")
-    await room.connect(url, token)
-    print(f"✅ Server connected to LiveKit room: {url}")
-    
-    # Test MP3 alert after 5 seconds
-    async def test_mp3_alert():
-        await asyncio.sleep(5)
-        print("🧪 Testing MP3 alert...")
-        await send_mp3_alert(room, "motion_alert.mp3", "Test motion alert")
-    
-    asyncio.create_task(test_mp3_alert())
-    
     # Set up audio track from audio file (MP3 or MP4)
     audio_file = "test_voice.mp3"  # Try MP3 first, fallback to MP4
     if not os.path.exists(audio_file):
         audio_file = "test_voice.mp4"
     
-    if os.path.exists(audio_file):
-        print(f"🎵 Loading audio from {audio_file}")
-        
-        # Load audio file based on extension
-        if audio_file.endswith('.mp3'):
-            # Load MP3 with pydub
-            audio_segment = AudioSegment.from_mp3(audio_file)
-            sample_rate = audio_segment.frame_rate
-            channels = audio_segment.channels
-            duration = len(audio_segment) / 1000.0  # Convert ms to seconds
-            
-            # Convert to numpy array (int16)
-            audio_data = np.array(audio_segment.get_array_of_samples())
-            if channels == 2:
-                # Convert stereo to mono by averaging channels
-                audio_data = audio_data.reshape(-1, 2).mean(axis=1).astype(np.int16)
-                channels = 1
-            
+    # ffmpeg decodes (and resamples to mono 48 kHz) block by block while the track plays;
+    # after the first full play the samples come from the memory-mapped cache instead
+    sample_rate = PLAYBACK_SAMPLE_RATE
+    channels = 1
+    
+    async def connect():
+        token = await asyncio.to_thread(get_token, "server", "Server", room_name)
+        await room.connect(url, token, options=subscription_rules.room_options())
+        # Publications that were already in the room when we joined get no track_published event
+        for participant in room.remote_participants.values():
+            for publication in participant.track_publications.values():
+                subscription_rules.apply(publication, participant)
+    
+    # Everything below owns the fleet processes, executor threads and room connection:
+    # a failed or cancelled startup releases them too, so shard restarts do not leak workers
+    connect_task = detectors_task = assets_task = audio_task = None
+    try:
+        # Connect, import the detectors, load alert clips and start decoding audio all at once
+        connect_task = asyncio.create_task(timed("connect", connect()))
+        detectors_task = asyncio.create_task(timed("detectors", asyncio.to_thread(import_detectors)))
+        assets_task = asyncio.create_task(timed("alert clips", asyncio.to_thread(alert_assets.load)))
+        if os.path.exists(audio_file):
+            print(f"🎵 Streaming audio from {audio_file}")
+            audio_task = asyncio.create_task(timed("audio decode", prefetch(
+                PcmCache().decode_pcm_blocks(audio_file, sample_rate, channels))))
         else:
-            # Load MP4 with moviepy
-            video_clip = VideoFileClip(audio_file)
-            audio_clip = video_clip.audio
-            
-            if audio_clip is not None:
-                sample_rate = int(audio_clip.fps)
-                channels = 1  # Force mono
-                duration = audio_clip.duration
-                
-                # Convert to numpy array
-                audio_array = audio_clip.to_soundarray()
-                audio_data = (audio_array * 32767).astype(np.int16)
-                
-                audio_clip.close()
-            else:
-                print(f"❌ No audio track found in {audio_file}")
-                return
-        
-        # Create audio source and track
-        audio_source = rtc.AudioSource(sample_rate, channels)
-        audio_track = rtc.LocalAudioTrack.create_audio_track("audio_file", audio_source)
-        await room.local_participant.publish_track(audio_track)
-        print(f"🎤 Audio track published: {channels}ch @ {sample_rate}Hz, {duration:.1f}s")
+            print(f"❌ Audio file not found: test_voice.mp3 or test_voice.mp4")
+    
+        motion, voice_activity, motion_batch, analyzer_fleet = await detectors_task
+        motion_config = motion.MotionConfig.from_env()
+        if analyzer_processes > 0:
+            fleet = analyzer_fleet.AnalyzerFleet(analyzer_processes, motion_config)
+        elif batch_interval > 0:
+            batcher = motion_batch.BatchMotionAnalyzer(motion_config, timings=video_timings)
+    
+        if fleet is not None:
+            fleet.start()
+            asyncio.create_task(handle_fleet_results(), name="fleet results")
+        if batcher is not None:
+            asyncio.create_task(run_motion_batches(), name="motion batches")
+    
+        await assets_task
+        asyncio.create_task(alert_assets.watch(float(os.getenv("ALERT_RELOAD_INTERVAL_S", "5"))))
+        ready.set()
+    
+        await connect_task
+        print(f"✅ Server connected to LiveKit room: {room_name} at {url}")
+    
+        # Test MP3 alert after 5 seconds
+        async def test_mp3_alert():
+            await asyncio.sleep(5)
+            print("🧪 Testing MP3 alert...")
+            dispatcher.submit(Alert("test", None, "motion_alert.mp3", "Test motion alert"))
+    
+        asyncio.create_task(test_mp3_alert())
+    
+        blocks = None
+        if audio_task is not None:
+            try:
+                blocks = await audio_task
+            except Exception as e:
+                print(f"❌ Error decoding audio file: {e}")
+    
+        if blocks is not None:
+            # Create audio source and track
+            audio_source = rtc.AudioSource(sample_rate, channels)
+            audio_track = rtc.LocalAudioTrack.create_audio_track("audio_file", audio_source)
+            await room.local_participant.publish_track(audio_track)
+            print(f"🎤 Audio track published: {channels}ch @ {sample_rate}Hz")
         
-        # Start audio playback task
-        asyncio.create_task(play_audio_file(audio_data, audio_source, sample_rate, channels))
-    else:
-        print(f"❌ Audio file not found: test_voice.mp3 or test_voice.mp4")
+            # Start audio playback task
+            asyncio.create_task(play_audio_file(blocks, audio_source), name="audio playback")
+    
+        steps = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_times.items())
+        print(f"🚀 Ready in {time.perf_counter() - START_TIME:.2f}s since start ({steps})")
     
-    await asyncio.sleep(float('inf'))
+        await asyncio.sleep(float('inf'))
+    finally:
+        for task in (connect_task, detectors_task, assets_task, audio_task):
+            if task is not None:
+                task.cancel()
+        await tracks.close_all()
+        if fleet is not None:
+            fleet.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+        await room.disconnect()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
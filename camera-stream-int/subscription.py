@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Which remote tracks server.py subscribes to.
+
+With SUBSCRIPTION_RULES=1 (the default) the server joins with auto_subscribe
+off, which applies to every participant in the room at once: nothing is
+subscribed unless a publication passes every rule below, so ignored streams
+(agent audio, egress/recorders, other servers, screen shares) are never sent
+to it or decoded. A client whose tracks should be analyzed must match the
+rules, and anything relying on the server receiving all tracks needs
+SUBSCRIPTION_RULES=0.
+
+  * SUBSCRIBE_IDENTITIES          identity globs to accept, e.g. "*officer*" (default "*")
+  * SUBSCRIBE_EXCLUDE_IDENTITIES  identity globs to refuse (default "server*")
+  * SUBSCRIBE_PARTICIPANT_KINDS   standard, ingress, egress, sip, agent, ... (default "standard")
+  * SUBSCRIBE_SOURCES             camera, microphone, screenshare, screenshare_audio, unknown
+                                  (default "camera,microphone,unknown")
+
+The PDA publishers tag their tracks as camera / microphone. "unknown" is the
+source of any track published without TrackPublishOptions, so older clients
+keep being analyzed; drop it from SUBSCRIBE_SOURCES once they are updated.
+
+All lists are comma separated. SUBSCRIPTION_RULES=0 subscribes to everything.
+"""
+import fnmatch
+import os
+from dataclasses import dataclass
+
+from livekit import rtc
+
+
+def _split(value):
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def participant_kind(participant):
+    """"standard", "agent", ... for a participant"""
+    return rtc.ParticipantKind.Name(participant.kind).removeprefix("PARTICIPANT_KIND_").lower()
+
+
+def track_source(publication):
+    """"camera", "microphone", ... for a track publication"""
+    return rtc.TrackSource.Name(publication.source).removeprefix("SOURCE_").lower()
+
+
+@dataclass
+class SubscriptionRules:
+    enabled: bool = True
+    identities: tuple = ("*",)
+    exclude_identities: tuple = ("server*",)
+    participant_kinds: tuple = ("standard",)
+    sources: tuple = ("camera", "microphone", "unknown")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("SUBSCRIPTION_RULES", "1") == "1",
+            identities=_split(os.getenv("SUBSCRIBE_IDENTITIES", ",".join(cls.identities))),
+            exclude_identities=_split(os.getenv("SUBSCRIBE_EXCLUDE_IDENTITIES", ",".join(cls.exclude_identities))),
+            participant_kinds=_split(os.getenv("SUBSCRIBE_PARTICIPANT_KINDS", ",".join(cls.participant_kinds))),
+            sources=_split(os.getenv("SUBSCRIBE_SOURCES", ",".join(cls.sources))),
+        )
+
+    def room_options(self):
+        return rtc.RoomOptions(auto_subscribe=not self.enabled)
+
+    def check(self, publication, participant):
+        """None when the publication should be subscribed, otherwise why not"""
+        identity = participant.identity
+        if not any(fnmatch.fnmatchcase(identity, pattern) for pattern in self.identities):
+            return f"identity {identity} not in {','.join(self.identities)}"
+        if any(fnmatch.fnmatchcase(identity, pattern) for pattern in self.exclude_identities):
+            return f"identity {identity} excluded"
+        kind = participant_kind(participant)
+        if kind not in self.participant_kinds:
+            return f"participant kind {kind}"
+        source = track_source(publication)
+        if source not in self.sources:
+            return f"track source {source}"
+        return None
+
+    def apply(self, publication, participant):
+        """Subscribe to a remote publication if the rules accept it; returns whether it is wanted"""
+        if not self.enabled:
+            return True
+        reason = self.check(publication, participant)
+        if reason is not None:
+            print(f"⏭️ Not subscribing to {track_source(publication)} track {publication.sid} from {participant.identity}: {reason}")
+            return False
+        if not publication.subscribed:
+            publication.set_subscribed(True)
+            print(f"🔔 Subscribing to {track_source(publication)} track {publication.sid} from {participant.identity}")
+        return True
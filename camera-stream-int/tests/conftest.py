@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The camera-stream-int modules are scripts imported by name, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+import alerts
+from alerts import Alert, AlertAssetRegistry, AlertDispatcher, RateLimiter
+
+
+class FakeParticipant:
+    def __init__(self):
+        self.published = []
+
+    async def publish_data(self, payload, topic, reliable, destination_identities):
+        self.published.append((topic, destination_identities))
+
+
+class FakeRoom:
+    name = "test-room"
+
+    def __init__(self):
+        self.local_participant = FakeParticipant()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """alerts.time.monotonic() under test control"""
+    now = [1000.0]
+    monkeypatch.setattr(alerts.time, "monotonic", lambda: now[0])
+    return now
+
+
+def dispatcher(**kwargs):
+    return AlertDispatcher(FakeRoom(), AlertAssetRegistry(), **kwargs)
+
+
+def motion(identity="officer-1", text="Motion"):
+    return Alert("motion", identity, "motion_alert.mp3", text)
+
+
+async def drain(d):
+    """Run the dispatcher until everything queued has been sent"""
+    task = asyncio.create_task(d.run())
+    await d.queue.join()
+    task.cancel()
+
+
+def test_rate_limiter_bursts_then_refills():
+    limiter = RateLimiter(rate=2, period=60.0)
+    for _ in range(2):
+        assert limiter.ready("officer-1", 0.0)
+        limiter.take("officer-1", 0.0)
+    assert not limiter.ready("officer-1", 0.0)
+    assert limiter.ready("officer-2", 0.0)  # Buckets are per key
+    assert not limiter.ready("officer-1", 29.0)
+    assert limiter.ready("officer-1", 30.0)  # One token back after period / rate
+
+
+def test_rate_limiter_never_exceeds_its_burst():
+    limiter = RateLimiter(rate=2, period=60.0)
+    limiter.take("officer-1", 0.0)
+    for _ in range(2):
+        assert limiter.ready("officer-1", 3600.0)
+        limiter.take("officer-1", 3600.0)
+    assert not limiter.ready("officer-1", 3600.0)
+
+
+def test_rate_limiter_zero_rate_is_unlimited():
+    limiter = RateLimiter(rate=0, period=60.0)
+    for _ in range(100):
+        limiter.take("officer-1", 0.0)
+    assert limiter.ready("officer-1", 0.0)
+
+
+def test_identical_queued_alerts_are_coalesced(clock):
+    d = dispatcher()
+    assert d.submit(motion(text="first"))
+    assert not d.submit(motion(text="second"))
+    assert d.submit(motion(identity="officer-2"))
+
+    assert d.depth == 2
+    queued = d.pending[motion().key]
+    assert (queued.count, queued.text) == (2, "second")
+    assert d.stats["coalesced"] == 1
+
+
+def test_alert_within_coalesce_window_after_send_is_dropped(clock):
+    d = dispatcher(coalesce_window=2.0)
+
+    async def scenario():
+        assert d.submit(motion())
+        await drain(d)
+        clock[0] += 1.0
+        assert not d.submit(motion())
+        clock[0] += 1.5
+        assert d.submit(motion())
+        await drain(d)
+
+    asyncio.run(scenario())
+    assert d.stats["sent"] == 2
+    assert d.stats["coalesced"] == 1
+
+
+def test_participant_and_type_rate_limits(clock):
+    d = dispatcher(coalesce_window=0, participant_rate=2, type_rate=2, rate_period=60.0)
+    speech = Alert("speech", "officer-1", "speech_alert.mp3", "Speech")
+    assert d.submit(motion())
+    assert d.submit(speech)
+    assert not d.submit(Alert("other", "officer-1", "motion_alert.mp3", "Other"))  # Participant bucket empty
+    assert d.submit(motion(identity="officer-2"))
+    assert not d.submit(motion(identity="officer-3"))  # Motion type bucket empty
+    assert d.stats["rate_limited"] == 2
+
+    clock[0] += 30.0  # Half a period refills one token of each bucket
+    assert d.submit(Alert("other", "officer-1", "motion_alert.mp3", "Other"))
+    assert d.submit(motion(identity="officer-3"))
+
+
+def test_full_queue_drops_without_spending_tokens(clock):
+    d = dispatcher(coalesce_window=0, participant_rate=5, max_queue=1)
+    assert d.submit(motion())
+    assert not d.submit(motion(identity="officer-2"))
+    assert d.stats["dropped"] == 1
+    assert d.participant_limit.ready("officer-2", clock[0])
+    assert d.participant_limit._tokens("officer-2", clock[0]) == 5
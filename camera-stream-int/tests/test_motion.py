@@ -0,0 +1,66 @@
+import pytest
+
+from motion import MAX_GRID_CELLS, FrameSampler, MotionConfig
+
+
+def test_grid_fits_the_heatmap_header(monkeypatch):
+    monkeypatch.setenv("MOTION_GRID_ROWS", str(MAX_GRID_CELLS))
+    monkeypatch.setenv("MOTION_GRID_COLS", "1")
+    config = MotionConfig.from_env()
+    assert bytes([config.grid_rows, config.grid_cols]) == bytes([255, 1])
+
+
+@pytest.mark.parametrize("rows, cols", [(MAX_GRID_CELLS + 1, 16), (12, 300), (0, 16)])
+def test_grid_out_of_range_is_rejected(monkeypatch, rows, cols):
+    monkeypatch.setenv("MOTION_GRID_ROWS", str(rows))
+    monkeypatch.setenv("MOTION_GRID_COLS", str(cols))
+    with pytest.raises(ValueError, match="grid_"):
+        MotionConfig.from_env()
+
+
+def sampled_times(sampler, start, end, fps=1000):
+    """Arrival times of a `fps` stream between start and end that the sampler picks.
+
+    The default stream is fast enough that only the sampler's schedule decides the count.
+    """
+    times = [start + i / fps for i in range(int((end - start) * fps))]
+    return [t for t in times if sampler.should_sample(t)]
+
+
+def test_sampler_idles_at_idle_fps():
+    sampler = FrameSampler(idle_fps=2.0, active_fps=10.0)
+    assert len(sampled_times(sampler, 0.0, 10.0)) == pytest.approx(20, abs=1)
+
+
+def test_motion_switches_to_active_fps_until_hold_expires():
+    sampler = FrameSampler(idle_fps=2.0, active_fps=10.0, active_hold=5.0)
+    assert sampler.should_sample(0.0)
+    sampler.record(True, None, 0.1)
+    assert sampler.should_sample(0.2)  # Pulled in from the idle 0.5s interval
+    assert len(sampled_times(sampler, 0.2, 5.0)) == pytest.approx(48, abs=2)
+    assert len(sampled_times(sampler, 6.0, 16.0)) == pytest.approx(20, abs=1)
+
+
+def test_over_budget_analysis_backs_off_up_to_max():
+    sampler = FrameSampler(idle_fps=2.0, budget=0.025, max_backoff=8.0)
+    for _ in range(20):
+        sampler.record(False, 0.1, 0.0)
+    assert sampler.backoff == 8.0
+    assert sampler.rate(0.0) == pytest.approx(2.0 / 8.0)
+
+
+def test_backoff_relaxes_once_back_under_budget():
+    sampler = FrameSampler(budget=0.025)
+    for _ in range(5):
+        sampler.record(False, 0.1, 0.0)
+    assert sampler.backoff > 1.0
+    for _ in range(50):
+        sampler.record(False, 0.001, 0.0)
+    assert sampler.backoff == 1.0
+
+
+def test_unknown_processing_time_leaves_backoff_alone():
+    sampler = FrameSampler(budget=0.025)
+    for _ in range(10):
+        sampler.record(False, None, 0.0)
+    assert (sampler.backoff, sampler.processing_time) == (1.0, 0.0)
@@ -0,0 +1,60 @@
+import numpy as np
+from livekit import rtc
+
+from motion import MotionConfig
+from motion_batch import BatchMotionAnalyzer
+
+WIDTH, HEIGHT = 640, 480
+
+
+def i420_frame(value=0):
+    data = np.full(WIDTH * HEIGHT * 3 // 2, value, dtype=np.uint8)
+    return rtc.VideoFrame(WIDTH, HEIGHT, rtc.VideoBufferType.I420, data.tobytes())
+
+
+def rows_in_use(batcher):
+    return sum(group.capacity - len(group.free) for group in batcher.groups.values())
+
+
+def test_resubscribe_keeps_new_registration_and_releases_old_row():
+    batcher = BatchMotionAnalyzer(MotionConfig())
+    batcher.add("TR_1")
+    batcher.analyze({"TR_1": i420_frame()})
+    assert rows_in_use(batcher) == 1
+
+    roi = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    roi[:, : WIDTH // 2] = 255
+    batcher.remove("TR_1")
+    batcher.add("TR_1", roi)
+    results = batcher.analyze({"TR_1": i420_frame()})
+
+    assert batcher.tracks["TR_1"].roi is roi
+    assert results["TR_1"] is None  # The new track warms up its own background
+    assert rows_in_use(batcher) == 1
+
+
+def test_add_replacing_a_track_releases_its_row():
+    batcher = BatchMotionAnalyzer(MotionConfig())
+    for _ in range(3):
+        batcher.add("TR_1")
+        batcher.analyze({"TR_1": i420_frame()})
+    assert rows_in_use(batcher) == 1
+
+
+def test_frame_of_removed_track_is_skipped():
+    batcher = BatchMotionAnalyzer(MotionConfig())
+    batcher.add("TR_1")
+    batcher.analyze({"TR_1": i420_frame()})
+
+    batcher.remove("TR_1")  # Lands after the tick already took TR_1's frame
+    results = batcher.analyze({"TR_1": i420_frame()})
+
+    assert results == {}
+    assert "TR_1" not in batcher.tracks
+    assert rows_in_use(batcher) == 0
+
+
+def test_unregistered_track_is_not_created():
+    batcher = BatchMotionAnalyzer(MotionConfig())
+    assert batcher.analyze({"TR_9": i420_frame()}) == {}
+    assert batcher.tracks == {}
@@ -0,0 +1,72 @@
+import numpy as np
+
+from voice_activity import VadConfig, VoiceActivityDetector
+
+RATE = 16000
+WINDOW = RATE * VadConfig.window_ms // 1000
+
+
+def tone(hz, amplitude, windows=1):
+    t = np.arange(WINDOW * windows) / RATE
+    return (amplitude * np.sin(2 * np.pi * hz * t)).astype(np.int16)
+
+
+def silence(windows=1):
+    return np.zeros(WINDOW * windows, dtype=np.int16)
+
+
+def detector():
+    return VoiceActivityDetector(RATE, VadConfig())
+
+
+def feed_windows(vad, samples):
+    """Speech flag after each window of samples"""
+    return [vad.process(samples[i:i + WINDOW]).speech for i in range(0, samples.size, WINDOW)]
+
+
+def test_speech_starts_after_min_speech_windows():
+    vad = detector()
+    flags = feed_windows(vad, tone(1000, 5000, windows=4))
+    assert flags == [False, False, True, True]
+
+
+def test_speech_is_held_for_the_hangover():
+    config = VadConfig()
+    vad = detector()
+    feed_windows(vad, tone(1000, 5000, windows=config.min_speech_windows))
+    flags = feed_windows(vad, silence(config.hangover_windows + 1))
+    assert flags == [True] * (config.hangover_windows - 1) + [False, False]
+
+
+def test_short_burst_never_becomes_speech():
+    vad = detector()
+    samples = np.concatenate([tone(1000, 5000, windows=2), silence(), tone(1000, 5000, windows=2)])
+    assert not any(feed_windows(vad, samples))
+
+
+def test_quiet_voice_band_tone_is_below_energy_threshold():
+    vad = detector()
+    result = vad.process(tone(1000, 500, windows=5))
+    assert not result.speech
+    assert 0 < result.level <= VadConfig.energy_threshold
+
+
+def test_broadband_noise_is_rejected_by_zero_crossings():
+    vad = detector()
+    noise = np.random.default_rng(0).integers(-8000, 8000, WINDOW * 5, dtype=np.int16)
+    result = vad.process(noise)
+    assert not result.speech
+    assert result.level > VadConfig.energy_threshold
+
+
+def test_loud_hum_below_the_voice_band_is_rejected():
+    vad = detector()
+    assert not vad.process(tone(100, 8000, windows=5)).speech
+
+
+def test_windows_span_process_calls():
+    vad = detector()
+    samples = tone(1000, 5000, windows=3)
+    results = [vad.process(samples[i:i + 100]) for i in range(0, samples.size, 100)]
+    assert sum(result.windows for result in results) == 3
+    assert results[-1].speech
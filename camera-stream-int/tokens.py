@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""LiveKit access tokens for the camera-stream-int components.
+
+get_token() returns a JWT for an identity and room. Tokens are minted from
+LIVEKIT_API_KEY / LIVEKIT_API_SECRET and cached per (identity, room) until
+they come within TOKEN_REFRESH_MARGIN_S of expiry, so reconnects reuse a
+token instead of signing a new one. With TOKEN_SERVICE_URL set, tokens come
+from the token service instead, so a device such as the Pi holds only the
+service's TOKEN_SERVICE_SECRET, never the API secret.
+
+The token service is this module run as a script:
+
+    python tokens.py --port 8787
+
+GET /token?identity=copilot-officer&room=copilot-room&name=Copilot%20Officer
+answers {"token": ..., "expires_at": ...}. A background thread re-mints
+every token it has handed out before it expires, so requests are served from
+the cache and never stall on signing or get a token that is about to lapse.
+
+A join token is as good as the API secret for the room it names, so the
+service only hands them out to callers that send
+"Authorization: Bearer $TOKEN_SERVICE_SECRET" (fetch_token() does this from
+the same variable). The secret is required whenever the service listens on
+anything other than loopback. TOKEN_SERVICE_ALLOW limits what can be asked
+for, as comma separated identity@room globs, e.g.
+"pda-officer@pda-room,server@pda-room". At most TOKEN_CACHE_SIZE tokens are
+cached; the least recently used one is dropped first.
+"""
+import argparse
+import datetime
+import fnmatch
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ROOM = "copilot-room"
+DEFAULT_TTL = 6 * 3600  # Seconds, the LiveKit default
+DEFAULT_REFRESH_MARGIN = 600
+DEFAULT_CACHE_SIZE = 256
+
+
+@dataclass
+class CachedToken:
+    jwt: str
+    name: str
+    expires_at: float  # Unix time
+
+    def fresh(self, margin):
+        return self.expires_at - time.time() > margin
+
+
+class TokenMinter:
+    """Mints room-join tokens and caches them by (identity, room)"""
+
+    def __init__(self, api_key=None, api_secret=None, ttl=None, refresh_margin=None, max_tokens=None):
+        self.api_key = api_key or os.getenv('LIVEKIT_API_KEY')
+        self.api_secret = api_secret or os.getenv('LIVEKIT_API_SECRET')
+        if not self.api_key or not self.api_secret:
+            raise ValueError("LIVEKIT_API_KEY and LIVEKIT_API_SECRET must be set in .env file")
+        self.ttl = ttl if ttl is not None else float(os.getenv("TOKEN_TTL_S", DEFAULT_TTL))
+        self.refresh_margin = refresh_margin if refresh_margin is not None else float(
+            os.getenv("TOKEN_REFRESH_MARGIN_S", DEFAULT_REFRESH_MARGIN))
+        self.max_tokens = max_tokens or int(os.getenv("TOKEN_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        self.tokens = OrderedDict()  # (identity, room) -> CachedToken, least recently used first
+        self.lock = threading.Lock()
+
+    def mint(self, identity, name, room):
+        # livekit.api pulls in aiohttp; only pay for it when something is actually signed
+        from livekit.api import AccessToken, VideoGrants
+
+        expires_at = time.time() + self.ttl
+        jwt = AccessToken(self.api_key, self.api_secret) \
+            .with_identity(identity) \
+            .with_name(name) \
+            .with_ttl(datetime.timedelta(seconds=self.ttl)) \
+            .with_grants(VideoGrants(
+                room_join=True,
+                room=room,
+            )) \
+            .to_jwt()
+        return CachedToken(jwt, name, expires_at)
+
+    def get(self, identity, name=None, room=DEFAULT_ROOM):
+        """A cached token for identity in room, minted on a miss or when close to expiry"""
+        name = name or identity
+        with self.lock:
+            cached = self.tokens.get((identity, room))
+            if cached is not None:
+                self.tokens.move_to_end((identity, room))
+        if cached is not None and cached.name == name and cached.fresh(self.refresh_margin):
+            return cached
+        cached = self.mint(identity, name, room)
+        with self.lock:
+            self.tokens[(identity, room)] = cached
+            self.tokens.move_to_end((identity, room))
+            while len(self.tokens) > self.max_tokens:
+                self.tokens.popitem(last=False)
+        return cached
+
+    def refresh_expiring(self):
+        """Re-mint every cached token inside the refresh margin; returns how many were refreshed"""
+        with self.lock:
+            expiring = [(key, cached) for key, cached in self.tokens.items() if not cached.fresh(self.refresh_margin)]
+        for (identity, room), cached in expiring:
+            fresh = self.mint(identity, cached.name, room)
+            with self.lock:
+                if (identity, room) in self.tokens:  # Not evicted meanwhile
+                    self.tokens[(identity, room)] = fresh
+        return len(expiring)
+
+    def start_refresher(self, interval=60.0):
+        """Keep cached tokens fresh from a daemon thread"""
+        def refresh_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    refreshed = self.refresh_expiring()
+                    if refreshed:
+                        print(f"🔑 Refreshed {refreshed} tokens")
+                except Exception as e:
+                    print(f"❌ Token refresh failed: {e}")
+
+        threading.Thread(target=refresh_forever, name="token-refresh", daemon=True).start()
+
+
+def fetch_token(service_url, identity, name=None, room=DEFAULT_ROOM, timeout=5.0, secret=None):
+    """Ask a token service for a token; returns a CachedToken"""
+    query = urllib.parse.urlencode({"identity": identity, "name": name or identity, "room": room})
+    request = urllib.request.Request(f"{service_url.rstrip('/')}/token?{query}")
+    secret = secret or os.getenv("TOKEN_SERVICE_SECRET")
+    if secret:
+        request.add_header("Authorization", f"Bearer {secret}")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = json.load(response)
+    return CachedToken(body["token"], name or identity, body["expires_at"])
+
+
+_minter = None
+_minter_lock = threading.Lock()
+
+
+def get_token(identity, name=None, room=DEFAULT_ROOM):
+    """JWT for identity in room, from TOKEN_SERVICE_URL if set, otherwise minted and cached locally"""
+    global _minter
+    service_url = os.getenv("TOKEN_SERVICE_URL")
+    if service_url:
+        return fetch_token(service_url, identity, name, room).jwt
+    with _minter_lock:
+        if _minter is None:
+            _minter = TokenMinter()
+    return _minter.get(identity, name, room).jwt
+
+
+def parse_allowlist(value):
+    """identity@room globs ("pda-officer@pda-room,server@*") as (identity, room) pairs; room defaults to *"""
+    pairs = []
+    for entry in (item.strip() for item in (value or "").split(",")):
+        if entry:
+            identity, _, room = entry.partition("@")
+            pairs.append((identity, room or "*"))
+    return pairs
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _TokenHandler(BaseHTTPRequestHandler):
+    minter = None  # Set by serve()
+    secret = None
+    allowlist = []  # (identity glob, room glob); empty allows any
+
+    def allowed(self, identity, room):
+        return not self.allowlist or any(
+            fnmatch.fnmatchcase(identity, i) and fnmatch.fnmatchcase(room, r) for i, r in self.allowlist)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path != "/token" or "identity" not in params:
+            self.send_error(404 if url.path != "/token" else 400, "expected /token?identity=...&room=...")
+            return
+        if self.secret:
+            supplied = self.headers.get("Authorization", "")
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {self.secret}".encode()):
+                self.send_error(401, "missing or wrong bearer secret")
+                return
+        room = params.get("room", DEFAULT_ROOM)
+        if not self.allowed(params["identity"], room):
+            self.send_error(403, f"{params['identity']}@{room} is not in TOKEN_SERVICE_ALLOW")
+            return
+        try:
+            cached = self.minter.get(params["identity"], params.get("name"), room)
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        body = json.dumps({"token": cached.jwt, "expires_at": cached.expires_at}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per token request is just noise
+
+
+def serve(host="127.0.0.1", port=8787, minter=None, secret=None, allowlist=None):
+    """Run the token service until interrupted"""
+    secret = secret or os.getenv("TOKEN_SERVICE_SECRET")
+    if not secret and not is_loopback(host):
+        raise ValueError(f"TOKEN_SERVICE_SECRET must be set to serve tokens on {host}")
+    _TokenHandler.secret = secret
+    _TokenHandler.allowlist = allowlist if allowlist is not None else parse_allowlist(os.getenv("TOKEN_SERVICE_ALLOW"))
+    _TokenHandler.minter = minter or TokenMinter()
+    _TokenHandler.minter.start_refresher()
+    server = ThreadingHTTPServer((host, port), _TokenHandler)
+    print(f"🔑 Token service listening on http://{host}:{port}/token")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv('.env')
+    parser = argparse.ArgumentParser(description="Local LiveKit token service")
+    parser.add_argument("--host", default=os.getenv("TOKEN_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("TOKEN_SERVICE_PORT", "8787")))
+    args = parser.parse_args()
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
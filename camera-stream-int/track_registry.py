@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Per-track lifecycle for server.py.
+
+Everything started for a subscribed track (its receive loop, analysis task,
+stream, frame slot and analyzer state) is owned by the tasks spawned for it
+through TrackRegistry, keyed by track SID. When the track is unsubscribed or
+its participant leaves, close() cancels those tasks and waits for them, so
+their finally blocks release the streams, frame slots, batch rows and fleet
+slots right away, and the track's metric series are dropped. Long shifts
+with many reconnects therefore keep a flat set of tracks and tasks.
+
+Closes started from synchronous room event handlers go through
+close_soon() / close_participant_soon(); the registry keeps those tasks
+until they finish, and close_all() waits for them as well.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from metrics import LIVE_TRACKS, forget_track
+
+
+@dataclass
+class TrackWork:
+    sid: str
+    identity: str
+    kind: str  # "video" / "audio"
+    started_at: float = field(default_factory=time.monotonic)
+    tasks: set = field(default_factory=set)
+
+    def describe(self):
+        return f"{self.identity} {self.kind} {self.sid} ({time.monotonic() - self.started_at:.0f}s, {len(self.tasks)} tasks)"
+
+
+class TrackRegistry:
+    """Live tracks keyed by SID, with the tasks each one runs"""
+
+    def __init__(self, room_name=""):
+        self.room_name = room_name
+        self.tracks = {}  # sid -> TrackWork
+        self.closing = set()  # Background close tasks still running
+        self.closed = 0
+
+    def __contains__(self, sid):
+        return sid in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def open(self, sid, identity, kind):
+        """Register a newly subscribed track; a stale entry for the same SID is closed first"""
+        stale = self.tracks.get(sid)
+        work = self.tracks[sid] = TrackWork(sid, identity, kind)
+        if stale is not None:
+            self._background(self._finish(stale, "resubscribed"), f"close {sid}")
+        self._update_gauge()
+        return work
+
+    def spawn(self, sid, coro, name=None):
+        """Run coro as one of the track's tasks; returns None (and closes coro) if the track is gone"""
+        work = self.tracks.get(sid)
+        if work is None:
+            coro.close()
+            return None
+        task = asyncio.create_task(coro, name=name)
+        work.tasks.add(task)
+        task.add_done_callback(work.tasks.discard)
+        return task
+
+    def _background(self, coro, name):
+        task = asyncio.create_task(coro, name=name)
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+        return task
+
+    def close_soon(self, sid, reason):
+        """close() from a synchronous callback, e.g. a room event handler"""
+        return self._background(self.close(sid, reason), f"close {sid}")
+
+    def close_participant_soon(self, identity, reason):
+        """close_participant() from a synchronous callback"""
+        return self._background(self.close_participant(identity, reason), f"close {identity}")
+
+    async def close(self, sid, reason):
+        """Cancel a track's tasks, wait for their cleanup and forget the track"""
+        work = self.tracks.pop(sid, None)
+        if work is None:
+            return False
+        self._update_gauge()
+        await self._finish(work, reason)
+        return True
+
+    async def _finish(self, work, reason):
+        sid = work.sid
+        current = asyncio.current_task()
+        tasks = [task for task in work.tasks if task is not current]
+        for task in tasks:
+            task.cancel()
+        for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(result, Exception):
+                print(f"❌ Track {sid} task {task.get_name()} failed while closing: {result}")
+        if sid not in self.tracks:  # Not reopened while we waited
+            forget_track(sid)
+        self.closed += 1
+        print(f"🧹 Closed {work.kind} track {sid} from {work.identity} ({reason})")
+
+    async def close_participant(self, identity, reason):
+        """Close every track of one participant; returns how many were closed"""
+        sids = [sid for sid, work in self.tracks.items() if work.identity == identity]
+        results = await asyncio.gather(*(self.close(sid, reason) for sid in sids))
+        return sum(results)
+
+    async def close_all(self, reason="shutdown"):
+        """Close every live track and wait for closes already under way"""
+        current = asyncio.current_task()
+        pending = [task for task in self.closing if task is not current]
+        await asyncio.gather(*(self.close(sid, reason) for sid in list(self.tracks)), *pending,
+                             return_exceptions=True)
+
+    def live(self):
+        """The currently live tracks, oldest first"""
+        return sorted(self.tracks.values(), key=lambda work: work.started_at)
+
+    def summary(self):
+        live = self.live()
+        lines = [f"{len(live)} live tracks, {self.closed} closed"]
+        lines += [work.describe() for work in live]
+        return lines
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            lines = self.summary()
+            print(f"🎛️ Tracks: {lines[0]}")
+            for line in lines[1:]:
+                print(f"   {line}")
+
+    def _update_gauge(self):
+        for kind in ("video", "audio"):
+            count = sum(1 for work in self.tracks.values() if work.kind == kind)
+            LIVE_TRACKS.set(count, room=self.room_name, kind=kind)
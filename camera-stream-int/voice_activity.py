@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Speech detection for server.py audio tracks.
+
+VoiceActivityDetector is a streaming VAD: every received sample is copied once
+into a fixed analysis window and each full window is scored on
+
+  * energy    - RMS from int32 squares accumulated in int64 (no float temporaries)
+  * zero-crossing rate - broadband noise crosses zero far more often than voice
+  * band energy - share of the window's spectral energy in the voice band,
+                  only computed for windows loud enough to matter
+
+A window counts as speech when all three agree. Speech starts after a few
+consecutive speech windows and is held for a short hangover so it does not
+flap between syllables.
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+SPEECH_VOLUME_THRESHOLD = 800  # RMS of int16 samples
+
+
+@dataclass
+class VadConfig:
+    window_ms: int = 20
+    energy_threshold: float = SPEECH_VOLUME_THRESHOLD
+    max_zero_crossing_rate: float = 0.35  # Crossings per sample
+    band_low_hz: float = 300.0
+    band_high_hz: float = 3400.0
+    min_band_ratio: float = 0.5
+    min_speech_windows: int = 3
+    hangover_windows: int = 10
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window_ms=int(os.getenv("VAD_WINDOW_MS", cls.window_ms)),
+            energy_threshold=float(os.getenv("VAD_ENERGY_THRESHOLD", cls.energy_threshold)),
+            max_zero_crossing_rate=float(os.getenv("VAD_MAX_ZCR", cls.max_zero_crossing_rate)),
+            min_band_ratio=float(os.getenv("VAD_MIN_BAND_RATIO", cls.min_band_ratio)),
+            min_speech_windows=int(os.getenv("VAD_MIN_SPEECH_WINDOWS", cls.min_speech_windows)),
+        )
+
+
+@dataclass
+class VadResult:
+    speech: bool  # Speech was active in at least one window completed by this call
+    level: float  # Loudest window RMS completed by this call
+    windows: int  # Windows completed by this call
+
+
+class VoiceActivityDetector:
+    """Streaming VAD for one audio track; all scratch buffers are allocated up front"""
+
+    def __init__(self, sample_rate, config=None, timings=None):
+        self.config = config or VadConfig.from_env()
+        self.timings = timings  # Optional profiling.StageTimings
+        self.sample_rate = sample_rate
+        size = max(2, sample_rate * self.config.window_ms // 1000)
+        self.window = np.empty(size, dtype=np.int16)
+        self.filled = 0
+        self.squares = np.empty(size, dtype=np.int32)
+        self.signs = np.empty(size, dtype=bool)
+        self.crossings = np.empty(size - 1, dtype=bool)
+        self.tapered = np.empty(size, dtype=np.float32)
+        self.taper = np.hanning(size).astype(np.float32)
+        freqs = np.fft.rfftfreq(size, 1 / sample_rate)
+        self.band = (freqs >= self.config.band_low_hz) & (freqs <= self.config.band_high_hz)
+        self.speech_run = 0
+        self.hangover = 0
+        self.active = False
+
+    def _score_window(self):
+        """Score the full analysis window; returns (is_speech, rms)"""
+        w = self.window
+        timings = self.timings
+        np.multiply(w, w, out=self.squares, dtype=np.int32)
+        rms = float(np.sqrt(self.squares.sum(dtype=np.int64) / w.size))
+        if timings is not None:
+            timings.lap("energy")
+        if rms <= self.config.energy_threshold:
+            return False, rms
+
+        np.signbit(w, out=self.signs)
+        np.not_equal(self.signs[1:], self.signs[:-1], out=self.crossings)
+        zero_crossing_rate = np.count_nonzero(self.crossings) / w.size
+        if timings is not None:
+            timings.lap("zero_crossings")
+        if zero_crossing_rate > self.config.max_zero_crossing_rate:
+            return False, rms
+
+        np.multiply(w, self.taper, out=self.tapered)
+        spectrum = np.fft.rfft(self.tapered)
+        power = spectrum.real * spectrum.real + spectrum.imag * spectrum.imag
+        total = power.sum()
+        band_ratio = power[self.band].sum() / total if total else 0.0
+        if timings is not None:
+            timings.lap("band")
+        return band_ratio >= self.config.min_band_ratio, rms
+
+    def _update_state(self, is_speech):
+        if is_speech:
+            self.speech_run += 1
+        else:
+            self.speech_run = 0
+        if self.speech_run >= self.config.min_speech_windows:
+            self.active = True
+            self.hangover = self.config.hangover_windows
+        elif self.active:
+            self.hangover -= 1
+            if self.hangover <= 0:
+                self.active = False
+
+    def process(self, samples):
+        """Feed a block of mono int16 samples (any length); returns a VadResult"""
+        speech = False
+        level = 0.0
+        windows = 0
+        size = self.window.size
+        timings = self.timings
+        if timings is not None:
+            timings.start()
+        offset = 0
+        while offset < samples.size:
+            n = min(size - self.filled, samples.size - offset)
+            self.window[self.filled:self.filled + n] = samples[offset:offset + n]
+            self.filled += n
+            offset += n
+            if self.filled == size:
+                self.filled = 0
+                if timings is not None:
+                    timings.lap("fill")
+                is_speech, rms = self._score_window()
+                self._update_state(is_speech)
+                if timings is not None:
+                    timings.lap("state")
+                speech = speech or self.active
+                level = max(level, rms)
+                windows += 1
+        return VadResult(speech, level, windows)
+
+
+def frame_samples(frame):
+    """Mono int16 view of an rtc.AudioFrame (first channel if interleaved), without copying"""
+    samples = np.frombuffer(frame.data, dtype=np.int16)
+    return samples[::frame.num_channels] if frame.num_channels > 1 else samples
+
+
+class SpeechAlertState:
+    """Per-track speech alert decision: VAD speech plus a cooldown"""
+
+    def __init__(self, cooldown=3.0):
+        self.cooldown = cooldown
+        self.last_alert_time = float("-inf")  # The first alert is never held back, whatever clock `now` uses
+
+    def update(self, speech, now):
+        """Record one VAD result's speech flag; returns True when an alert should be sent"""
+        if not speech or (now - self.last_alert_time) <= self.cooldown:
+            return False
+        self.last_alert_time = now
+        return True